@@ -1,11 +1,15 @@
+import functools
 import os
 import sys
+import threading
 import time
 from pathlib import Path
 from typing import Union, Optional, List
 
 import uvicorn
 from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 
 if "toponym-resolution" in __file__:
@@ -21,8 +25,6 @@ from config import CONFIG as pipeline_config
 
 from geoparser import pipeline
 
-geoparser = pipeline.Pipeline(**pipeline_config)
-
 
 class APIQuery(BaseModel):
     text: str
@@ -42,7 +44,60 @@ class DisambiguationAPIQuery(BaseModel):
 
 
 app_config_name = os.environ["APP_CONFIG_NAME"]
-app = FastAPI(title=f"Toponym Resolution Pipeline API ({app_config_name})")
+app = FastAPI(
+    title=f"Toponym Resolution Pipeline API ({app_config_name})",
+    default_response_class=ORJSONResponse,
+)
+
+
+@app.on_event("startup")
+async def load_pipeline():
+    # Load the pipeline (and its resources) once per worker process when the
+    # worker starts, instead of as a side effect of importing this module:
+    app.state.geoparser = pipeline.Pipeline(**pipeline_config)
+
+
+@app.on_event("shutdown")
+async def close_pipeline():
+    # Stop the worker processes started by the pipeline, if any:
+    app.state.geoparser.close()
+
+
+# The pipeline keeps state between calls (e.g. the candidates already
+# collected by the ranker), so only one thread may use it at a time:
+geoparser_lock = threading.Lock()
+
+
+def call_geoparser(method, *args, **kwargs):
+    with geoparser_lock:
+        return method(*args, **kwargs)
+
+
+async def run_geoparser(method, *args, **kwargs):
+    # Run the blocking pipeline call in a worker thread, so that the event
+    # loop can keep serving other requests (e.g. health checks) meanwhile:
+    return await run_in_threadpool(call_geoparser, method, *args, **kwargs)
+
+
+@functools.lru_cache(maxsize=100_000)
+def find_toponym_candidates(toponym: str) -> dict:
+    # Toponyms repeat a lot across requests, so the candidates of each one
+    # are cached (the returned dictionary must therefore not be modified):
+    wk_cands = app.state.geoparser.run_candidate_selection(
+        [{"mention": toponym, "tag": "LOC"}]
+    )
+    return wk_cands[toponym]
+
+
+def select_candidates(toponyms: List[dict]) -> dict:
+    # Same selection of mentions as in Pipeline.run_candidate_selection:
+    without_microtoponyms = app.state.geoparser.mylinker.rel_params.get(
+        "without_microtoponyms", False
+    )
+    mentions = dict.fromkeys(
+        y["mention"] for y in toponyms if not without_microtoponyms or y["tag"] == "LOC"
+    )
+    return {mention: find_toponym_candidates(mention) for mention in mentions}
 
 
 @app.get("/")
@@ -51,8 +106,9 @@ async def read_root(request: Request):
 
 
 @app.get("/test")
-async def test_pipeline():
-    resolved = geoparser.run_sentence(
+async def test_pipeline(request: Request):
+    resolved = await run_geoparser(
+        request.app.state.geoparser.run_sentence,
         "Harvey, from London;Thomas and Elizabeth, Barnett.",
         place="Manchester",
         place_wqid="Q18125",
@@ -62,33 +118,46 @@ async def test_pipeline():
 
 
 @app.get("/resolve_sentence")
-async def run_sentence(api_query: APIQuery, request_id: Union[str, None] = None):
+async def run_sentence(
+    request: Request, api_query: APIQuery, request_id: Union[str, None] = None
+):
     place = "" if api_query.place is None else api_query.place
     place_wqid = "" if api_query.place_wqid is None else api_query.place_wqid
-    resolved = geoparser.run_sentence(
-        api_query.text, place=place, place_wqid=place_wqid
+    resolved = await run_geoparser(
+        request.app.state.geoparser.run_sentence,
+        api_query.text,
+        place=place,
+        place_wqid=place_wqid,
     )
 
     return resolved
 
 
 @app.get("/resolve_full_text")
-async def run_text(api_query: APIQuery):
+async def run_text(request: Request, api_query: APIQuery):
 
     place = "" if api_query.place is None else api_query.place
     place_wqid = "" if api_query.place_wqid is None else api_query.place_wqid
-    resolved = geoparser.run_text(api_query.text, place=place, place_wqid=place_wqid)
+    resolved = await run_geoparser(
+        request.app.state.geoparser.run_text,
+        api_query.text,
+        place=place,
+        place_wqid=place_wqid,
+    )
 
     return resolved
 
 
 @app.get("/run_ner")
-async def run_ner(api_query: APIQuery):
+async def run_ner(request: Request, api_query: APIQuery):
 
     place = "" if api_query.place is None else api_query.place
     place_wqid = "" if api_query.place_wqid is None else api_query.place_wqid
-    ner_output = geoparser.run_text_recognition(
-        api_query.text, place=place, place_wqid=place_wqid
+    ner_output = await run_geoparser(
+        request.app.state.geoparser.run_text_recognition,
+        api_query.text,
+        place=place,
+        place_wqid=place_wqid,
     )
 
     return ner_output
@@ -97,23 +166,31 @@ async def run_ner(api_query: APIQuery):
 @app.get("/run_candidate_selection")
 async def run_candidate_selection(cand_api_query: CandidatesAPIQuery):
 
-    wk_cands = geoparser.run_candidate_selection(cand_api_query.toponyms)
+    wk_cands = await run_geoparser(select_candidates, cand_api_query.toponyms)
     return wk_cands
 
 
 @app.get("/run_disambiguation")
-async def run_disambiguation(api_query: DisambiguationAPIQuery):
+async def run_disambiguation(request: Request, api_query: DisambiguationAPIQuery):
     place = "" if api_query.place is None else api_query.place
     place_wqid = "" if api_query.place_wqid is None else api_query.place_wqid
-    disamb_output = geoparser.run_disambiguation(
-        api_query.dataset, api_query.wk_cands, place, place_wqid
+    disamb_output = await run_geoparser(
+        request.app.state.geoparser.run_disambiguation,
+        api_query.dataset,
+        api_query.wk_cands,
+        place,
+        place_wqid,
     )
     return disamb_output
 
 
+# The health check response never changes, so it is built only once:
+HEALTH_OK = {"status": "ok"}
+
+
 @app.get("/health")
 async def healthcheck():
-    return {"status": "ok"}
+    return HEALTH_OK
 
 
 if __name__ == "__main__":
@@ -4,6 +4,7 @@ import sys
 from pathlib import Path
 from typing import Literal, Optional
 
+import orjson
 import pandas as pd
 from tqdm import tqdm
 
@@ -11,6 +12,9 @@ sys.path.insert(0, os.path.abspath(os.path.pardir))
 from geoparser import linking, ranking, recogniser
 from utils import process_data, rel_utils
 
+# Number of sentences passed to the entity disambiguation model at once:
+ED_PREDICT_BATCH_SIZE = 32
+
 
 class Experiment:
     """
@@ -25,7 +29,10 @@ class Experiment:
         results_path (str): The path to the directory where the results will
             be stored. If it does not exist, it will be created.
         dataset_df (pandas.DataFrame): The dataframe representing the
-            resulting, preprocessed, dataset.
+            resulting, preprocessed, dataset. If empty, it is loaded from
+            ``linking_df_split.tsv`` in ``data_path``, otherwise it is used
+            as is (e.g. to share the same dataframe across several
+            experiments on the same dataset).
         myner (recogniser.Recogniser): An instance of the NER model to use.
         myranker (ranking.Ranker): An instance of the candidate ranking model
             to use.
@@ -74,21 +81,22 @@ class Experiment:
         self.rel_experiments = rel_experiments
         self.end_to_end_eval = end_to_end_eval
 
-        # Load the dataset as a dataframe:
-        dataset_path = os.path.join(
-            self.data_path, self.dataset, "linking_df_split.tsv"
-        )
-
-        if Path(dataset_path).exists():
-            self.dataset_df = pd.read_csv(
-                dataset_path,
-                sep="\t",
-            )
-        else:
-            sys.exit(
-                "\nError: The dataset has not been created, you should first run the prepare_data.py script.\n"
+        # Load the dataset as a dataframe, unless it has already been loaded:
+        if self.dataset_df.empty:
+            dataset_path = os.path.join(
+                self.data_path, self.dataset, "linking_df_split.tsv"
             )
 
+            if Path(dataset_path).exists():
+                self.dataset_df = pd.read_csv(
+                    dataset_path,
+                    sep="\t",
+                )
+            else:
+                sys.exit(
+                    "\nError: The dataset has not been created, you should first run the prepare_data.py script.\n"
+                )
+
         if self.end_to_end_eval == True:
             self.data_path = self.data_path + "end_to_end/"
             self.results_path = self.results_path + "end_to_end/"
@@ -220,15 +228,18 @@ class Experiment:
         # -------------------------------------------
         # Perform candidate ranking:
         print("\n* Perform candidate ranking:")
-        dCandidates = dict()
-        # Obtain candidates per sentence:
-        for sentence_id in tqdm(dMentionsPred):
-            pred_mentions_sent = dMentionsPred[sentence_id]
-            (
-                wk_cands,
-                self.myranker.already_collected_cands,
-            ) = self.myranker.find_candidates(pred_mentions_sent)
-            dCandidates[sentence_id] = wk_cands
+        # Obtain candidates for the mentions of all sentences in a single
+        # call to the ranker (which only processes each unique mention once,
+        # and runs DeezyMatch on all of them at once), instead of one call
+        # per sentence, and split them back per sentence:
+        sentence_ids = list(dMentionsPred.keys())
+        (
+            sentence_cands,
+            self.myranker.already_collected_cands,
+        ) = self.myranker.find_candidates_batch(
+            [dMentionsPred[sentence_id] for sentence_id in sentence_ids]
+        )
+        dCandidates = dict(zip(sentence_ids, sentence_cands))
 
         # -------------------------------------------
         # Store temporary postprocessed data
@@ -292,7 +303,10 @@ class Experiment:
 
         Note:
             This function also creates one JSON file per dictionary, stored in
-            ``outputs/data``.
+            ``outputs/data``. They are serialised with ``orjson``, which is
+            considerably faster than the standard ``json`` module on the
+            larger dictionaries (NumPy values, such as candidate scores, are
+            serialised as their Python equivalents).
         """
         data_path = self.data_path
         dataset = self.dataset
@@ -307,40 +321,42 @@ class Experiment:
             )
 
         # Store NER predictions using a specific NER model:
-        with open(output_path + "_ner_predictions.json", "w") as fw:
-            json.dump(preds, fw)
+        with open(output_path + "_ner_predictions.json", "wb") as fw:
+            fw.write(orjson.dumps(preds, option=orjson.OPT_SERIALIZE_NUMPY))
 
         # Store gold standard:
-        with open(output_path + "_gold_standard.json", "w") as fw:
-            json.dump(trues, fw)
+        with open(output_path + "_gold_standard.json", "wb") as fw:
+            fw.write(orjson.dumps(trues, option=orjson.OPT_SERIALIZE_NUMPY))
 
         # Store NER skyline:
-        with open(output_path + "_ner_skyline.json", "w") as fw:
-            json.dump(skys, fw)
+        with open(output_path + "_ner_skyline.json", "wb") as fw:
+            fw.write(orjson.dumps(skys, option=orjson.OPT_SERIALIZE_NUMPY))
 
         # Store gold tokenisation positions:
-        with open(output_path + "_gold_positions.json", "w") as fw:
-            json.dump(gold_tok, fw)
+        with open(output_path + "_gold_positions.json", "wb") as fw:
+            fw.write(orjson.dumps(gold_tok, option=orjson.OPT_SERIALIZE_NUMPY))
 
         # Store the dictionary of sentences:
-        with open(output_path + "_dict_sentences.json", "w") as fw:
-            json.dump(dSentences, fw)
+        with open(output_path + "_dict_sentences.json", "wb") as fw:
+            fw.write(orjson.dumps(dSentences, option=orjson.OPT_SERIALIZE_NUMPY))
 
-        # Store the dictionary of metadata per sentence:
+        # Store the dictionary of metadata per sentence (with the standard
+        # json module, as missing metadata values may be NaN, which orjson
+        # would turn into null):
         with open(output_path + "_dict_metadata.json", "w") as fw:
             json.dump(dMetadata, fw)
 
         # Store the dictionary of predicted results:
-        with open(output_path + "_pred_mentions.json", "w") as fw:
-            json.dump(dMentionsPred, fw)
+        with open(output_path + "_pred_mentions.json", "wb") as fw:
+            fw.write(orjson.dumps(dMentionsPred, option=orjson.OPT_SERIALIZE_NUMPY))
 
         # Store the dictionary of gold standard:
-        with open(output_path + "_gold_mentions.json", "w") as fw:
-            json.dump(dMentionsGold, fw)
+        with open(output_path + "_gold_mentions.json", "wb") as fw:
+            fw.write(orjson.dumps(dMentionsGold, option=orjson.OPT_SERIALIZE_NUMPY))
 
         # Store the dictionary of gold standard:
-        with open(output_path + "_candidates_" + cand_approach + ".json", "w") as fw:
-            json.dump(dCandidates, fw)
+        with open(output_path + "_candidates_" + cand_approach + ".json", "wb") as fw:
+            fw.write(orjson.dumps(dCandidates, option=orjson.OPT_SERIALIZE_NUMPY))
 
         dict_processed_data = dict()
         dict_processed_data["preds"] = preds
@@ -384,11 +400,23 @@ class Experiment:
 
         rows = []
         for sentence_id in dMentions:
+            # Information shared by all mentions in the sentence is only
+            # extracted once per sentence:
+            split_sentence_id = sentence_id.split("_")
+            article_id = split_sentence_id[0]
+            sentence_pos = split_sentence_id[1]
+            sentence = dSentences[sentence_id]
+            place = dMetadata[sentence_id]["place"]
+            year = dMetadata[sentence_id]["year"]
+            publication = dMetadata[sentence_id]["publication_code"]
+            place_wqid = dMetadata[sentence_id]["place_wqid"]
+            sentence_candidates = dCandidates[sentence_id]
+            gold_token_sets = [
+                (set(range(gs["start_offset"], gs["end_offset"] + 1)), gs)
+                for gs in dGoldSt[sentence_id]
+            ]
             for mention in dMentions[sentence_id]:
                 if mention:
-                    article_id = sentence_id.split("_")[0]
-                    sentence_pos = sentence_id.split("_")[1]
-                    sentence = dSentences[sentence_id]
                     token_start = mention["start_offset"]
                     token_end = mention["end_offset"]
                     char_start = mention["start_char"]
@@ -396,27 +424,20 @@ class Experiment:
                     ner_score = round(mention["ner_score"], 3)
                     pred_mention = mention["mention"]
                     entity_type = mention["ner_label"]
-                    place = dMetadata[sentence_id]["place"]
-                    year = dMetadata[sentence_id]["year"]
-                    publication = dMetadata[sentence_id]["publication_code"]
-                    place_wqid = dMetadata[sentence_id]["place_wqid"]
                     # Match predicted mention with gold standard mention (will just be used for training):
                     max_tok_overlap = 0
                     gold_standard_link = "NIL"
                     gold_standard_ner = "O"
                     gold_mention = ""
-                    for gs in dGoldSt[sentence_id]:
-                        pred_token_range = range(token_start, token_end + 1)
-                        gs_token_range = range(gs["start_offset"], gs["end_offset"] + 1)
-                        overlap = len(list(set(pred_token_range) & set(gs_token_range)))
+                    pred_token_set = set(range(token_start, token_end + 1))
+                    for gs_token_set, gs in gold_token_sets:
+                        overlap = len(pred_token_set & gs_token_set)
                         if overlap > max_tok_overlap:
                             max_tok_overlap = overlap
                             gold_mention = gs["mention"]
                             gold_standard_link = gs["entity_link"]
                             gold_standard_ner = gs["ner_label"]
-                    candidates = dCandidates[sentence_id].get(
-                        mention["mention"], dict()
-                    )
+                    candidates = sentence_candidates.get(mention["mention"], dict())
 
                     rows.append(
                         [
@@ -649,6 +670,14 @@ class Experiment:
         if self.test_split == "apply":
             list_test_splits = ["apply"]
 
+        # Dictionary of sentences (the same for all data splits):
+        # {k1 : {k2 : v}}, where k1 is article id, k2 is
+        # sentence pos, and v is the sentence text.
+        nested_sentences_dict = dict()
+        for key, val in self.processed_data["dSentences"].items():
+            key1, key2 = key.split("_")
+            nested_sentences_dict.setdefault(key1, dict())[int(key2)] = val
+
         # ------------------------------------------
         # Iterate over each linking experiments, each will have its own
         # results file:
@@ -656,17 +685,16 @@ class Experiment:
             original_df = self.dataset_df
             processed_df = self.processed_data["processed_df"]
 
-            test_original = original_df[original_df[split] == "test"]
-            test_processed = processed_df[processed_df[split] == "test"]
-
-            if split == "apply":
-                # This is not used in the experiments: in the "apply" mode, we are
-                # training on what would be train+dev in the originalsplit, and
-                # leave test for development. We're just testing on dev itself
-                # to avoid the code failing. The model trained with this scenario
-                # should just be used with new data not in the experiments.
-                test_original = original_df[original_df[split] == "dev"]
-                test_processed = processed_df[processed_df[split] == "dev"]
+            # Select the evaluation subset of each dataframe only once. This
+            # is the test set, except in the "apply" mode, which is not used
+            # in the experiments: in the "apply" mode, we are training on what
+            # would be train+dev in the originalsplit, and leave test for
+            # development. We're just testing on dev itself to avoid the code
+            # failing. The model trained with this scenario should just be
+            # used with new data not in the experiments.
+            eval_split = "dev" if split == "apply" else "test"
+            test_original = original_df[original_df[split] == eval_split]
+            test_processed = processed_df[processed_df[split] == eval_split]
 
             # Get ids of articles in each split:
             test_article_ids = list(test_original.article_id.astype(str))
@@ -676,26 +704,14 @@ class Experiment:
             print("Train EL model using:", split)
             linking_model = self.mylinker.train_load_model(self.myranker, split=split)
 
-            # Dictionary of sentences:
-            # {k1 : {k2 : v}}, where k1 is article id, k2 is
-            # sentence pos, and v is the sentence text.
-            nested_sentences_dict = dict()
-            for key, val in self.processed_data["dSentences"].items():
-                key1, key2 = key.split("_")
-                key2 = int(key2)
-                if key1 in nested_sentences_dict:
-                    nested_sentences_dict[key1][key2] = val
-                else:
-                    nested_sentences_dict[key1] = {key2: val}
-
             # Predict:
             print("Process data into sentences.")
-            to_append = []
             mentions_dataset = dict()
             all_cands = dict()
-            for i, row in tqdm(test_processed.iterrows()):
+            # Iterate over the rows as plain dictionaries, which is much
+            # cheaper than building a Series per row with iterrows:
+            for mention_data in tqdm(test_processed.to_dict("records")):
                 prediction = dict()
-                mention_data = row.to_dict()
                 sentence_id = mention_data["sentence_id"]
                 article_id = mention_data["article_id"]
                 prediction["mention"] = mention_data["pred_mention"]
@@ -727,72 +743,115 @@ class Experiment:
                         and mention_data["pred_ner_label"] != "LOC"
                     ):
                         prediction["candidates"] = dict()
-                if sentence_id in mentions_dataset:
-                    mentions_dataset[sentence_id].append(prediction)
-                else:
-                    mentions_dataset[sentence_id] = [prediction]
+                mentions_dataset.setdefault(sentence_id, []).append(prediction)
                 all_cands.update({prediction["mention"]: prediction["candidates"]})
 
             if self.mylinker.method == "reldisamb":
                 rel_resolved = dict()
-                for sentence_id in mentions_dataset:
-                    article_dataset = {sentence_id: mentions_dataset[sentence_id]}
-                    article_dataset = rel_utils.rank_candidates(
-                        article_dataset,
+                # Disambiguate several sentences (each one a separate
+                # document for the model) with each call to the model:
+                sentence_ids = list(mentions_dataset.keys())
+                for batch_start in range(0, len(sentence_ids), ED_PREDICT_BATCH_SIZE):
+                    batch_ids = sentence_ids[
+                        batch_start : batch_start + ED_PREDICT_BATCH_SIZE
+                    ]
+                    batch_dataset = {
+                        sentence_id: mentions_dataset[sentence_id]
+                        for sentence_id in batch_ids
+                    }
+                    batch_dataset = rel_utils.rank_candidates(
+                        batch_dataset,
                         all_cands,
                         self.mylinker.linking_resources["mentions_to_wikidata"],
                     )
                     if self.mylinker.rel_params["with_publication"]:
                         # If "publ", add an artificial publication entry:
-                        article_dataset = rel_utils.add_publication(article_dataset)
-                    predicted = linking_model.predict(article_dataset)
-                    if self.mylinker.rel_params["with_publication"]:
-                        # ... and if "publ", now remove the artificial publication entry!
-                        predicted[sentence_id].pop()
-                    for i in range(len(predicted[sentence_id])):
-                        combined_mention = article_dataset[sentence_id][i]
-                        combined_mention["prediction"] = predicted[sentence_id][i][
-                            "prediction"
-                        ]
-                        combined_mention["ed_score"] = predicted[sentence_id][i][
-                            "conf_ed"
-                        ]
-                        if sentence_id in rel_resolved:
-                            rel_resolved[sentence_id].append(combined_mention)
-                        else:
-                            rel_resolved[sentence_id] = [combined_mention]
-                    mentions_dataset[sentence_id] = rel_resolved[sentence_id]
-
-            for i, row in tqdm(test_processed.iterrows()):
-                prediction = dict()
-                for mention in mentions_dataset[row["sentence_id"]]:
-                    if (
-                        int(mention["pos"]) == int(row["char_start"])
-                        and int(mention["sent_idx"]) == int(row["sentence_pos"])
-                        and mention["mention"] == row["pred_mention"]
-                    ):
-                        prediction = mention
-
-                        if self.mylinker.method in ["mostpopular", "bydistance"]:
-                            # Run entity linking per mention:
-                            selected_cand = self.mylinker.run(
+                        batch_dataset = rel_utils.add_publication(batch_dataset)
+                    predicted = linking_model.predict(batch_dataset)
+                    for sentence_id in batch_ids:
+                        if self.mylinker.rel_params["with_publication"]:
+                            # ... and if "publ", now remove the artificial publication entry!
+                            predicted[sentence_id].pop()
+                        for i in range(len(predicted[sentence_id])):
+                            combined_mention = batch_dataset[sentence_id][i]
+                            combined_mention["prediction"] = predicted[sentence_id][i][
+                                "prediction"
+                            ]
+                            combined_mention["ed_score"] = predicted[sentence_id][i][
+                                "conf_ed"
+                            ]
+                            rel_resolved.setdefault(sentence_id, []).append(
+                                combined_mention
+                            )
+                        mentions_dataset[sentence_id] = rel_resolved[sentence_id]
+
+            # Index the mentions by sentence, position and mention text, to
+            # match each row of the dataframe with its mention directly (if
+            # there are duplicates, the last one is kept):
+            mentions_index = {
+                (
+                    sentence_id,
+                    int(mention["pos"]),
+                    int(mention["sent_idx"]),
+                    mention["mention"],
+                ): mention
+                for sentence_id, sentence_mentions in mentions_dataset.items()
+                for mention in sentence_mentions
+            }
+
+            # Build the key of each row from whole columns, converting the
+            # positions to integers once per column rather than once per row:
+            row_keys = zip(
+                test_processed["sentence_id"].tolist(),
+                test_processed["char_start"].astype(int).tolist(),
+                test_processed["sentence_pos"].astype(int).tolist(),
+                test_processed["pred_mention"].tolist(),
+            )
+            row_predictions = [mentions_index.get(key, dict()) for key in row_keys]
+
+            if self.mylinker.method in ["mostpopular", "bydistance"]:
+                # The candidates of a mention only depend on the mention
+                # itself, so each unique pair of mention and place of
+                # publication is only linked once:
+                to_link = dict()
+                for prediction in row_predictions:
+                    if prediction:
+                        to_link.setdefault(
+                            (prediction["mention"], prediction["place_wqid"]),
+                            prediction,
+                        )
+
+                # Run entity linking on all unique mentions at once:
+                selected_cands = dict(
+                    zip(
+                        to_link.keys(),
+                        self.mylinker.run_batch(
+                            [
                                 {
                                     "candidates": prediction["candidates"],
                                     "place_wqid": prediction["place_wqid"],
                                 }
-                            )
-                            prediction["prediction"] = selected_cand[0]
-                            prediction["ed_score"] = round(selected_cand[1], 3)
-
-                to_append.append(
-                    [
-                        prediction["prediction"],
-                        round(prediction["ed_score"], 3),
-                    ]
+                                for prediction in to_link.values()
+                            ]
+                        ),
+                    )
                 )
-
-            test_df = test_processed.copy()
-            test_df[["pred_wqid", "ed_score"]] = to_append
+                for prediction in row_predictions:
+                    if prediction:
+                        selected_cand = selected_cands[
+                            (prediction["mention"], prediction["place_wqid"])
+                        ]
+                        prediction["prediction"] = selected_cand.prediction
+                        prediction["ed_score"] = round(selected_cand.score, 3)
+
+            # Add the predictions to the (already filtered) test mentions,
+            # which only copies the test subset once:
+            test_df = test_processed.assign(
+                pred_wqid=[prediction["prediction"] for prediction in row_predictions],
+                ed_score=[
+                    round(prediction["ed_score"], 3) for prediction in row_predictions
+                ],
+            )
 
             # Prepare data for scorer:
             self.processed_data = process_data.prepare_storing_links(
@@ -8,6 +8,7 @@ import os
 import random
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 from sklearn.model_selection import train_test_split
 
@@ -33,7 +34,8 @@ gazetteer_ids = set(
     list(
         pd.read_csv(
             os.path.join(resources, "wikidata", "wikidata_gazetteer.csv"),
-            low_memory=False,
+            usecols=["wikidata_id"],
+            dtype={"wikidata_id": str},
         )["wikidata_id"].unique()
     )
 )
@@ -116,20 +118,18 @@ lwm_train_df, lwm_dev_df = train_test_split(
 lwm_all_df = pd.concat([lwm_train_df, lwm_dev_df, lwm_test_df])
 lwm_all_df["place_wqid"] = lwm_all_df["publication_code"].map(dict_placewqid)
 
+# Masks of the articles in each original split (computed once for all rows):
+in_lwm_test = lwm_all_df["article_id"].isin(lwm_test_df["article_id"])
+in_lwm_train = lwm_all_df["article_id"].isin(lwm_train_df["article_id"])
+
 # Add a column for the ner_split (i.e. the original split)
-lwm_all_df["originalsplit"] = lwm_all_df["article_id"].apply(
-    lambda x: "test"
-    if x in list(lwm_test_df["article_id"].unique())
-    else "train"
-    if x in list(lwm_train_df["article_id"].unique())
-    else "dev"
+lwm_all_df["originalsplit"] = np.select(
+    [in_lwm_test, in_lwm_train], ["test", "train"], default="dev"
 )
 
 # Add a column for the ner_split in the "apply" case (i.e. no test required,
 # as this is not used for the experiments).
-lwm_all_df["apply"] = lwm_all_df["article_id"].apply(
-    lambda x: "dev" if x in list(lwm_test_df["article_id"].unique()) else "train"
-)
+lwm_all_df["apply"] = np.where(in_lwm_test, "dev", "train")
 
 # Split the train set into train and dev for development
 # (i.e. when test is not used):
@@ -137,14 +137,14 @@ lwm_train_dev_df, lwm_dev_dev_df = train_test_split(
     lwm_train_df, test_size=0.33, random_state=RANDOM_SEED
 )
 # Add a column for the ner_split (i.e. the original split)
-lwm_all_df["withouttest"] = lwm_all_df["article_id"].apply(
-    lambda x: "test"
-    if x in list(lwm_dev_df["article_id"].unique())
-    else "train"
-    if x in list(lwm_train_dev_df["article_id"].unique())
-    else "dev"
-    if x in list(lwm_dev_dev_df["article_id"].unique())
-    else "left_out"
+lwm_all_df["withouttest"] = np.select(
+    [
+        lwm_all_df["article_id"].isin(lwm_dev_df["article_id"]),
+        lwm_all_df["article_id"].isin(lwm_train_dev_df["article_id"]),
+        lwm_all_df["article_id"].isin(lwm_dev_dev_df["article_id"]),
+    ],
+    ["test", "train", "dev"],
+    default="left_out",
 )
 
 groups = [i for i, group in lwm_all_df.groupby(["place", "decade"])]
@@ -155,17 +155,17 @@ for group in groups:
     dev_group = random.choice(remainers)
     # Name the experiment after the test split:
     group_name = group[0].split("-")[0] + str(group[1])
-    # Assign each file to train, dev, or test for each experiment:
-    train_test_column = []
-    for i, row in lwm_all_df.iterrows():
-        if row["place"] == group[0] and row["decade"] == group[1]:
-            train_test_column.append("test")
-        elif row["place"] == dev_group[0] and row["decade"] == dev_group[1]:
-            train_test_column.append("dev")
-        else:
-            train_test_column.append("train")
-    # Store the split in a column named after the experiment (after the test split):
-    lwm_all_df[group_name] = train_test_column
+    # Assign each file to train, dev, or test for each experiment, and store
+    # the split in a column named after the experiment (after the test split):
+    lwm_all_df[group_name] = np.select(
+        [
+            (lwm_all_df["place"] == group[0]) & (lwm_all_df["decade"] == group[1]),
+            (lwm_all_df["place"] == dev_group[0])
+            & (lwm_all_df["decade"] == dev_group[1]),
+        ],
+        ["test", "dev"],
+        default="train",
+    )
 
 # Store dataframe:
 lwm_all_df.to_csv(
@@ -217,22 +217,16 @@ train_ids = list(hipe_train_df.article_id.unique())
 dev_ids = list(hipe_dev_df.article_id.unique())
 test_ids = list(hipe_dev_df.article_id.unique())
 
-dev_test = []  # Original split: into dev and test only
-train_dev_test = []  # Following the original split, but dev split into train and dev
-for i, row in hipe_all_df.iterrows():
-    if row["article_id"] in list(hipe_train_df.article_id.unique()):
-        dev_test.append("dev")
-        train_dev_test.append("dev")
-    elif row["article_id"] in list(hipe_dev_df.article_id.unique()):
-        dev_test.append("dev")
-        train_dev_test.append("test")
-    else:
-        dev_test.append("test")
-        train_dev_test.append("left_out")
+in_hipe_train = hipe_all_df["article_id"].isin(hipe_train_df.article_id)
+in_hipe_dev = hipe_all_df["article_id"].isin(hipe_dev_df.article_id)
 
 # Store the split in a column named after the experiment:
-hipe_all_df["originalsplit"] = dev_test
-hipe_all_df["withouttest"] = train_dev_test
+# * Original split: into dev and test only.
+hipe_all_df["originalsplit"] = np.where(in_hipe_train | in_hipe_dev, "dev", "test")
+# * Following the original split, but dev split into train and dev.
+hipe_all_df["withouttest"] = np.select(
+    [in_hipe_train, in_hipe_dev], ["dev", "test"], default="left_out"
+)
 
 # Store dataframe:
 hipe_all_df.to_csv(output_path_hipe + "linking_df_split.tsv", sep="\t", index=False)
@@ -36,6 +36,9 @@ experiments = [
     # ["hipe", "deezymatch", "reldisamb", "fine", True, True],
 ]
 
+# Dataframes of the datasets already loaded, shared across experiments:
+dataset_dfs = dict()
+
 # Mapping experiment parameters:
 for exp_param in experiments:
     print("============")
@@ -138,7 +141,7 @@ for exp_param in experiments:
     myexperiment = experiment.Experiment(
         dataset=dataset,
         data_path="outputs/data/",
-        dataset_df=pd.DataFrame(),
+        dataset_df=dataset_dfs.get(dataset, pd.DataFrame()),
         results_path="outputs/results/",
         myner=myner,
         myranker=myranker,
@@ -150,6 +153,8 @@ for exp_param in experiments:
         end_to_end_eval=False,  # False if we're not evaluating end-to-end for EL, True if we're evaluating "EL-only"
     )
 
+    dataset_dfs[dataset] = myexperiment.dataset_df
+
     # Print experiment information:
     print(myexperiment)
     print(myner)
@@ -185,3 +190,6 @@ for exp_param in experiments:
 
     # Do the linking experiments:
     myexperiment.linking_experiments()
+
+    # Stop the NER post-processing workers, if any:
+    myner.close()
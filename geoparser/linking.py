@@ -1,12 +1,12 @@
-import json
 import os
+import pickle
 import sys
+from collections import OrderedDict
 from pathlib import Path
-from typing import Literal, Optional, Tuple
+from typing import List, Literal, NamedTuple, Optional
 
 import numpy as np
 import pandas as pd
-from haversine import haversine
 from tqdm import tqdm
 
 tqdm.pandas()
@@ -14,13 +14,96 @@ tqdm.pandas()
 RANDOM_SEED = 42
 np.random.seed(RANDOM_SEED)
 
+# Mean Earth radius in km, as used by the ``haversine`` library:
+AVG_EARTH_RADIUS_KM = 6371.0088
+
+# Linking resources derived from the files in ``resources/wikidata/``, which
+# are cached together as a single pickle file:
+CACHED_LINKING_RESOURCES = [
+    "mentions_to_wikidata",
+    "coords",
+    "wqid_to_index",
+    "wqid_to_coords",
+    "wikidata_locs",
+    "entity2class",
+]
+
 # Add "../" to path to import utils
-sys.path.insert(0, os.path.abspath(os.path.pardir))
+if os.path.abspath(os.path.pardir) not in sys.path:
+    sys.path.insert(0, os.path.abspath(os.path.pardir))
 
 from geoparser import ranking
 from utils import rel_utils
 from utils.REL import entity_disambiguation
 
+# Maximum number of entity disambiguation models kept in LOADED_ED_MODELS,
+# with the least recently used models being released first:
+ED_MODELS_CACHE_SIZE = 4
+
+# Entity disambiguation models trained or loaded from disk, shared by all
+# Linker objects in the process. Keyed on the path to the model, each value is
+# a tuple with the embeddings database cursor the model was created with and
+# the model:
+LOADED_ED_MODELS = OrderedDict()
+
+
+class LinkingResult(NamedTuple):
+    """
+    The result of linking a mention with one of the unsupervised methods of
+    the :py:meth:`~geoparser.linking.Linker`. Being a tuple, it can also be
+    unpacked as ``(prediction, score, candidates)``.
+
+    Attributes:
+        prediction (str): The Wikidata ID of the predicted entity (e.g.
+            ``"Q84"``), or ``"NIL"``.
+        score (float): The confidence score of the predicted link.
+        candidates (dict): A dictionary of all candidates and their
+            confidence scores.
+    """
+
+    prediction: str
+    score: float
+    candidates: dict
+
+
+def valid_coordinates(coords: List[float]) -> bool:
+    """
+    Checks whether a pair of coordinates is within the valid range of
+    latitudes and longitudes (i.e. the range accepted by ``haversine``).
+
+    Arguments:
+        coords (List[float]): A ``[latitude, longitude]`` pair.
+
+    Returns:
+        bool: Whether the coordinates are valid.
+    """
+    lat, lon = coords
+    return not (lat < -90 or lat > 90 or lon < -180 or lon > 180)
+
+
+def haversine_distances(origin_coords: List[float], coords: np.ndarray) -> np.ndarray:
+    """
+    Computes the great-circle distances (in km) between one point and an
+    array of points in a single vectorised operation. The formula and Earth
+    radius are the same as in ``haversine.haversine``.
+
+    Arguments:
+        origin_coords (List[float]): The ``[latitude, longitude]`` pair of
+            the origin point.
+        coords (numpy.ndarray): An array of shape ``(n, 2)`` with the
+            ``[latitude, longitude]`` pairs of the destination points.
+
+    Returns:
+        numpy.ndarray: An array of shape ``(n,)`` with the distances in km.
+    """
+    lat1, lng1 = np.radians(origin_coords)
+    lat2, lng2 = np.radians(coords).T
+    d = (
+        np.sin((lat2 - lat1) * 0.5) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) * 0.5) ** 2
+    )
+    return 2 * AVG_EARTH_RADIUS_KM * np.arcsin(np.sqrt(d))
+
 
 class Linker:
     """
@@ -151,25 +234,60 @@ class Linker:
 
         Note:
             Different methods will require different resources.
+
+            The resources are cached in a pickle file in the
+            ``resources/wikidata/`` folder, which is used instead on
+            subsequent runs, as long as it is up to date and can be read.
         """
         print("*** Load linking resources.")
 
+        files = {
+            "mentions_to_wikidata": f"{self.resources_path}wikidata/mentions_to_wikidata.json",
+            "gazetteer": f"{self.resources_path}wikidata/wikidata_gazetteer.csv",
+            "entity2class": f"{self.resources_path}wikidata/entity2class.txt",
+        }
+
+        # The resources are cached as a pickle, which is rebuilt whenever
+        # any of the files they are derived from is newer than the cache:
+        cache_path = f"{self.resources_path}wikidata/linking_resources.pkl"
+        if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= max(
+            os.path.getmtime(path) for path in files.values()
+        ):
+            print("  > Loading linking resources from cache.")
+            # A cache that cannot be read (e.g. corrupted, or written by other
+            # versions of Python or pandas) is rebuilt rather than failing
+            # every run:
+            try:
+                with open(cache_path, "rb") as f:
+                    self.linking_resources.update(pickle.load(f))
+                print("*** Linking resources loaded!\n")
+                return self.linking_resources
+            except (pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+                print(f"  > The cached linking resources could not be read: {e}")
+
         # Load Wikidata mentions-to-QID with absolute counts:
         print("  > Loading mentions to wikidata mapping.")
-        with open(self.resources_path + "wikidata/mentions_to_wikidata.json", "r") as f:
-            self.linking_resources["mentions_to_wikidata"] = json.load(f)
+        self.linking_resources["mentions_to_wikidata"] = ranking.load_json(
+            files["mentions_to_wikidata"]
+        )
 
         print("  > Loading gazetteer.")
         gaz = pd.read_csv(
-            f"{self.resources_path}wikidata/wikidata_gazetteer.csv",
+            files["gazetteer"],
             usecols=["wikidata_id", "latitude", "longitude"],
+            dtype={"wikidata_id": str, "latitude": float, "longitude": float},
+        )
+        # Coordinates are also kept as a single (n, 2) array, together with
+        # a mapping from Wikidata ID to row, so that the coordinates of many
+        # candidates can be gathered at once:
+        gaz_coords = gaz[["latitude", "longitude"]].to_numpy()
+        self.linking_resources["coords"] = gaz_coords
+        self.linking_resources["wqid_to_index"] = dict(
+            zip(gaz.wikidata_id, range(len(gaz)))
         )
-        gaz["latitude"] = gaz["latitude"].astype(float)
-        gaz["longitude"] = gaz["longitude"].astype(float)
-        gaz["coords"] = gaz[["latitude", "longitude"]].to_numpy().tolist()
-        wqid_to_coords = dict(zip(gaz.wikidata_id, gaz.coords))
+        wqid_to_coords = dict(zip(gaz.wikidata_id, gaz_coords.tolist()))
         self.linking_resources["wqid_to_coords"] = wqid_to_coords
-        gaz_ids = set(gaz["wikidata_id"].tolist())
+        gaz_ids = set(self.linking_resources["wqid_to_index"])
         # Keep only wikipedia entities in the gazetteer:
         self.linking_resources["wikidata_locs"] = gaz_ids
         gaz_ids = ""
@@ -177,13 +295,27 @@ class Linker:
 
         # The entity2class.txt file is created as the last step in
         # wikipedia processing:
-        with open(f"{self.resources_path}wikidata/entity2class.txt", "r") as f:
-            self.linking_resources["entity2class"] = json.load(f)
+        self.linking_resources["entity2class"] = ranking.load_json(
+            files["entity2class"]
+        )
+
+        # Write the cache to a temporary file first, so that an interrupted
+        # run never leaves a truncated (but fresh-looking) cache behind:
+        try:
+            with open(cache_path + ".tmp", "wb") as f:
+                pickle.dump(
+                    {k: self.linking_resources[k] for k in CACHED_LINKING_RESOURCES},
+                    f,
+                    protocol=pickle.HIGHEST_PROTOCOL,
+                )
+            os.replace(cache_path + ".tmp", cache_path)
+        except OSError as e:
+            print(f"  > The linking resources could not be cached: {e}")
 
         print("*** Linking resources loaded!\n")
         return self.linking_resources
 
-    def run(self, dict_mention: dict) -> Tuple[str, float, dict]:
+    def run(self, dict_mention: dict) -> LinkingResult:
         """
         Executes the linking process based on the specified unsupervised
         method.
@@ -192,7 +324,7 @@ class Linker:
             dict_mention: Dictionary containing the mention information.
 
         Returns:
-            Tuple[str, float, dict]:
+            LinkingResult:
                 The result of the linking process. For details, see below:
 
                 - If the ``method`` provided when initialising the
@@ -213,7 +345,30 @@ class Linker:
 
         raise SyntaxError(f"Unknown method provided: {self.method}")
 
-    def most_popular(self, dict_mention: dict) -> Tuple[str, float, dict]:
+    def run_batch(self, dict_mentions: List[dict]) -> List[LinkingResult]:
+        """
+        Executes the linking process based on the specified unsupervised
+        method for a list of mentions at once.
+
+        Arguments:
+            dict_mentions (List[dict]): List of dictionaries containing the
+                mention information.
+
+        Returns:
+            List[LinkingResult]:
+                For each mention (in the same order), the result of the
+                linking process, as returned by
+                :py:meth:`~geoparser.linking.Linker.run`.
+        """
+        if self.method == "mostpopular":
+            return self.most_popular_batch(dict_mentions)
+
+        if self.method == "bydistance":
+            return self.by_distance_batch(dict_mentions)
+
+        raise SyntaxError(f"Unknown method provided: {self.method}")
+
+    def most_popular(self, dict_mention: dict) -> LinkingResult:
         """
         Select most popular candidate, given Wikipedia's in-link structure.
 
@@ -222,7 +377,7 @@ class Linker:
                 needed to disambiguate a certain mention.
 
         Returns:
-            Tuple[str, float, dict]:
+            LinkingResult:
                 A tuple containing the most popular candidate's Wikidata ID
                 (e.g. ``"Q84"``) or ``"NIL"``, the confidence score of the
                 predicted link as a float, and a dictionary of all candidates
@@ -234,38 +389,109 @@ class Linker:
             entities. Given a set of candidates for a given mention, the
             function returns as a prediction the more relevant Wikidata
             candidate, determined from the in-link structure of Wikipedia.
+            It is a batch of one mention for
+            :py:meth:`~geoparser.linking.Linker.most_popular_batch`.
         """
-        cands = dict_mention["candidates"]
-        most_popular_candidate_id = "NIL"
-        keep_highest_score = 0.0
-        total_score = 0.0
-        final_score = 0.0
-        all_candidates = {}
-        if cands:
-            for variation in cands:
-                for candidate in cands[variation]["Candidates"]:
-                    score = self.linking_resources["mentions_to_wikidata"][variation][
-                        candidate
-                    ]
-                    total_score += score
-                    all_candidates[candidate] = score
-                    if score > keep_highest_score:
-                        keep_highest_score = score
-                        most_popular_candidate_id = candidate
+        # Gather the candidate scores into an array and reduce it with NumPy:
+        return self.most_popular_batch([dict_mention])[0]
 
-            # Return the predicted and the score (overall the total):
-            final_score = keep_highest_score / total_score
+    def most_popular_batch(self, dict_mentions: List[dict]) -> List[LinkingResult]:
+        """
+        Select the most popular candidate, given Wikipedia's in-link
+        structure, for a list of mentions at once. The candidates and
+        scores of all mentions are gathered into flat arrays, so that the
+        most popular candidate of each mention is found in a single
+        vectorised operation.
+
+        Arguments:
+            dict_mentions (List[dict]): list of dictionaries with all the
+                relevant information needed to disambiguate each mention.
 
-            # Compute scores for all candidates
-            all_candidates = {
-                cand: (score / total_score) for cand, score in all_candidates.items()
-            }
+        Returns:
+            List[LinkingResult]:
+                For each mention (in the same order), the same output as
+                :py:meth:`~geoparser.linking.Linker.most_popular`.
+        """
+        mentions_to_wikidata = self.linking_resources["mentions_to_wikidata"]
+
+        # Gather the candidates and scores of all mentions into flat lists,
+        # keeping the number of candidates and the total score per mention:
+        cand_ids = []
+        cand_scores = []
+        counts = []
+        total_scores = []
+        for dict_mention in dict_mentions:
+            nb_cands = len(cand_ids)
+            total_score = 0.0
+            for variation, variation_cands in dict_mention["candidates"].items():
+                variation_scores = mentions_to_wikidata[variation]
+                for candidate in variation_cands["Candidates"]:
+                    score = variation_scores[candidate]
+                    total_score += score
+                    cand_ids.append(candidate)
+                    cand_scores.append(score)
+            counts.append(len(cand_ids) - nb_cands)
+            total_scores.append(total_score)
+
+        if not cand_ids:
+            return [LinkingResult("NIL", 0.0, dict()) for _ in dict_mentions]
+
+        # Find the highest score of each mention with candidates, and the
+        # position of its first occurrence:
+        counts = np.array(counts)
+        has_cands = counts > 0
+        group_counts = counts[has_cands]
+        scores = np.array(cand_scores, dtype=float)
+        starts = (np.cumsum(counts) - counts)[has_cands]
+        max_scores = np.maximum.reduceat(scores, starts)
+        max_positions = np.flatnonzero(scores == np.repeat(max_scores, group_counts))
+        best_positions = max_positions[np.searchsorted(max_positions, starts)]
+
+        # Normalise the scores of all candidates by the total of their
+        # mention, dividing in place into the array of repeated totals so
+        # that no temporary array is allocated for the result:
+        norm_scores = np.repeat(np.array(total_scores)[has_cands], group_counts)
+        np.divide(scores, norm_scores, out=norm_scores)
+        norm_scores = norm_scores.tolist()
+
+        # Convert the per-mention results to Python lists once, so that they
+        # are not accessed as NumPy scalars in the loop below:
+        max_scores = max_scores.tolist()
+        best_positions = best_positions.tolist()
+
+        results = []
+        group = 0
+        start = 0
+        for count, total_score in zip(counts.tolist(), total_scores):
+            if count == 0:
+                results.append(LinkingResult("NIL", 0.0, dict()))
+                continue
+            keep_highest_score = 0.0
+            most_popular_candidate_id = "NIL"
+            if max_scores[group] > 0.0:
+                keep_highest_score = max_scores[group]
+                most_popular_candidate_id = cand_ids[best_positions[group]]
+            all_candidates = dict(
+                zip(
+                    cand_ids[start : start + count],
+                    norm_scores[start : start + count],
+                )
+            )
+            results.append(
+                LinkingResult(
+                    most_popular_candidate_id,
+                    keep_highest_score / total_score,
+                    all_candidates,
+                )
+            )
+            group += 1
+            start += count
 
-        return most_popular_candidate_id, final_score, all_candidates
+        return results
 
     def by_distance(
         self, dict_mention: dict, origin_wqid: Optional[str] = ""
-    ) -> Tuple[str, float, dict]:
+    ) -> LinkingResult:
         """
         Select candidate based on distance to the place of publication.
 
@@ -276,7 +502,7 @@ class Linker:
                 calculation. Defaults to ``""``.
 
         Returns:
-            Tuple[str, float, dict]:
+            LinkingResult:
                 A tuple containing the Wikidata ID of the closest candidate
                 to the place of publication (e.g. ``"Q84"``) or ``"NIL"``,
                 the confidence score of the predicted link as a float (rounded
@@ -291,12 +517,150 @@ class Linker:
             location closest to the place of publication, for a provided set
             of candidates and the place of publication of the original text.
         """
-        cands = dict_mention["candidates"]
+        origin_coords = self.get_origin_coords(dict_mention, origin_wqid)
+        cand_distances = self.candidate_distances(
+            origin_coords, [dict_mention["candidates"]]
+        )
+        return self.score_by_distance(dict_mention["candidates"], cand_distances)
+
+    def by_distance_batch(
+        self, dict_mentions: List[dict], origin_wqid: Optional[str] = ""
+    ) -> List[LinkingResult]:
+        """
+        Select candidates based on distance to the place of publication for
+        a list of mentions at once. The distances to the candidates of all
+        mentions sharing the same place of publication are computed in a
+        single vectorised operation.
+
+        Arguments:
+            dict_mentions (List[dict]): list of dictionaries with all the
+                relevant information needed to disambiguate each mention.
+            origin_wqid (str, optional): The origin Wikidata ID for distance
+                calculation. Defaults to ``""``.
+
+        Returns:
+            List[LinkingResult]:
+                For each mention (in the same order), the same output as
+                :py:meth:`~geoparser.linking.Linker.by_distance`.
+        """
+        # Group mentions by origin coordinates:
+        origins = dict()
+        mention_origins = []
+        for dict_mention in dict_mentions:
+            origin_coords = self.get_origin_coords(dict_mention, origin_wqid)
+            key = tuple(origin_coords) if origin_coords is not None else None
+            origins[key] = origin_coords
+            mention_origins.append(key)
+
+        # Compute all distances once per origin:
+        origin_distances = {
+            key: self.candidate_distances(
+                origin_coords,
+                [
+                    dict_mention["candidates"]
+                    for dict_mention, mention_key in zip(dict_mentions, mention_origins)
+                    if mention_key == key
+                ],
+            )
+            for key, origin_coords in origins.items()
+        }
+
+        return [
+            self.score_by_distance(dict_mention["candidates"], origin_distances[key])
+            for dict_mention, key in zip(dict_mentions, mention_origins)
+        ]
+
+    def get_origin_coords(
+        self, dict_mention: dict, origin_wqid: Optional[str] = ""
+    ) -> Optional[List[float]]:
+        """
+        Returns the coordinates of the origin (i.e. the place of publication)
+        used to compute distances for a mention.
+
+        Arguments:
+            dict_mention (dict): dictionary with all the relevant information
+                needed to disambiguate a certain mention.
+            origin_wqid (str, optional): The origin Wikidata ID. If not found
+                in the gazetteer, the ``place_wqid`` of the mention is used.
+                Defaults to ``""``.
+
+        Returns:
+            Optional[List[float]]:
+                The ``[latitude, longitude]`` pair of the origin, or None.
+        """
         origin_coords = self.linking_resources["wqid_to_coords"].get(origin_wqid)
         if not origin_coords:
             origin_coords = self.linking_resources["wqid_to_coords"].get(
                 dict_mention["place_wqid"]
             )
+        return origin_coords
+
+    def candidate_distances(
+        self, origin_coords: Optional[List[float]], all_cands: List[dict]
+    ) -> dict:
+        """
+        Computes the distances from the origin to all the unique candidates
+        in a list of candidate dictionaries, in a single vectorised
+        operation.
+
+        Arguments:
+            origin_coords (List[float], optional): The ``[latitude,
+                longitude]`` pair of the origin.
+            all_cands (List[dict]): A list of candidate dictionaries, in the
+                format of ``dict_mention["candidates"]``.
+
+        Returns:
+            dict:
+                A dictionary mapping each candidate Wikidata ID with valid
+                coordinates (we have one candidate with coordinates in
+                Venus!) to its distance to the origin, in km. It is empty if
+                the origin coordinates are missing or invalid.
+        """
+        if origin_coords is None or not valid_coordinates(origin_coords):
+            return dict()
+
+        wqid_to_index = self.linking_resources["wqid_to_index"]
+        cand_ids = list(
+            dict.fromkeys(
+                candidate
+                for cands in all_cands
+                if cands
+                for x in cands
+                for candidate in cands[x]["Candidates"]
+            )
+        )
+        cand_coords = self.linking_resources["coords"][
+            [wqid_to_index[candidate] for candidate in cand_ids]
+        ].reshape(-1, 2)
+
+        # Skip candidates with invalid coordinates:
+        lats = cand_coords[:, 0]
+        lngs = cand_coords[:, 1]
+        valid = ~((lats < -90) | (lats > 90) | (lngs < -180) | (lngs > 180))
+        valid_idx = np.flatnonzero(valid)
+        if not valid_idx.size:
+            return dict()
+
+        # Compute the distances to all candidates at once:
+        distances = haversine_distances(origin_coords, cand_coords[valid_idx])
+        return dict(zip([cand_ids[i] for i in valid_idx], distances.tolist()))
+
+    def score_by_distance(self, cands: dict, cand_distances: dict) -> LinkingResult:
+        """
+        Selects the candidate closest to the place of publication, given the
+        precomputed distances to the candidates, and computes its score.
+
+        Arguments:
+            cands (dict): The candidates of the mention, in the format of
+                ``dict_mention["candidates"]``.
+            cand_distances (dict): A dictionary mapping candidate Wikidata IDs
+                to their distance to the place of publication, as returned
+                by :py:meth:`~geoparser.linking.Linker.candidate_distances`.
+
+        Returns:
+            LinkingResult:
+                See :py:meth:`~geoparser.linking.Linker.by_distance`.
+        """
         closest_candidate_id = "NIL"
         max_on_gb = 1000  # 1000 km, max on GB
         keep_lowest_distance = max_on_gb  # 20000 km, max on Earth
@@ -307,15 +671,11 @@ class Linker:
             for x in cands:
                 matching_score = cands[x]["Score"]
                 for candidate, score in cands[x]["Candidates"].items():
-                    cand_coords = self.linking_resources["wqid_to_coords"][candidate]
-                    geodist = 20000
-                    # if origin_coords and cand_coords:  # If there are coordinates
-                    try:
-                        geodist = haversine(origin_coords, cand_coords)
-                        all_candidates[candidate] = geodist
-                    except ValueError:
-                        # We have one candidate with coordinates in Venus!
-                        pass
+                    if not candidate in cand_distances:
+                        continue
+                    geodist = cand_distances[candidate]
+                    all_candidates[candidate] = geodist
+                    # NaN distances are never the closest:
                     if geodist < keep_lowest_distance:
                         keep_lowest_distance = geodist
                         closest_candidate_id = candidate
@@ -333,7 +693,7 @@ class Linker:
         if not closest_candidate_id == "NIL":
             final_score = round((keep_lowest_relv + keep_lowest_distance) / 2, 3)
 
-        return closest_candidate_id, final_score, all_candidates
+        return LinkingResult(closest_candidate_id, final_score, all_candidates)
 
     def train_load_model(
         self, myranker: ranking.Ranker, split: Optional[str] = "originalsplit"
@@ -360,6 +720,12 @@ class Linker:
             ``do_test`` key's value set to True when initiating the Linker
             object.
 
+            A model that has already been trained or loaded in the same
+            process with the same embeddings database is returned directly
+            (unless ``overwrite_training`` is set to True) instead of being
+            loaded again from disk. Up to ``ED_MODELS_CACHE_SIZE`` models are
+            kept in ``LOADED_ED_MODELS``.
+
         .. note::
 
             **Credit:**
@@ -399,6 +765,17 @@ class Linker:
                 linker_name += "_test"
             linker_name = os.path.join(self.rel_params["model_path"], linker_name)
 
+            # Reuse the model if it has already been trained or loaded with
+            # the same embeddings database:
+            db_embeddings, model = LOADED_ED_MODELS.get(linker_name, (None, None))
+            if (
+                self.overwrite_training == False
+                and model is not None
+                and db_embeddings is self.rel_params["db_embeddings"]
+            ):
+                LOADED_ED_MODELS.move_to_end(linker_name)
+                return model
+
             if self.overwrite_training == True or not Path(linker_name).is_dir():
                 print(
                     "The entity disambiguation model does not exist or overwrite_training is set to True."
@@ -457,8 +834,6 @@ class Linker:
 
                 # Train and predict using LR (to obtain confidence scores)
                 model.train_LR(train_json, dev_json, linker_name)
-
-                return model
             else:
                 # Setting disambiguation model mode to "eval":
                 config_rel = {
@@ -471,4 +846,11 @@ class Linker:
                     config_rel,
                 )
 
-                return model
+            # Keep the model (replacing any model previously trained or loaded
+            # from the same path), and release the least recently used models
+            # if there are too many:
+            LOADED_ED_MODELS.pop(linker_name, None)
+            LOADED_ED_MODELS[linker_name] = (self.rel_params["db_embeddings"], model)
+            while len(LOADED_ED_MODELS) > ED_MODELS_CACHE_SIZE:
+                LOADED_ED_MODELS.popitem(last=False)
+            return model
@@ -6,10 +6,29 @@ from typing import List, Optional, Tuple
 from sentence_splitter import split_text_into_sentences
 
 # Add "../" to path to import utils
-sys.path.insert(0, os.path.abspath(os.path.pardir))
+if os.path.abspath(os.path.pardir) not in sys.path:
+    sys.path.insert(0, os.path.abspath(os.path.pardir))
 from geoparser import linking, ranking, recogniser
 from utils import ner, rel_utils
 
+# Fields of a linked mention that are kept in the postprocessed output:
+OUTPUT_KEYS = frozenset(
+    [
+        "sent_idx",
+        "mention",
+        "pos",
+        "end_pos",
+        "tag",
+        "prediction",
+        "ner_score",
+        "ed_score",
+        "sentence",
+        "string_match_score",
+        "prior_cand_score",
+        "cross_cand_score",
+    ]
+)
+
 
 class Pipeline:
     """
@@ -147,6 +166,8 @@ class Pipeline:
         place_wqid: Optional[str] = "",
         postprocess_output: Optional[bool] = True,
         without_microtoponyms: Optional[bool] = False,
+        mentions: Optional[List[dict]] = None,
+        candidates: Optional[dict] = None,
     ) -> List[dict]:
         """
         Runs the pipeline on a single sentence.
@@ -167,6 +188,16 @@ class Pipeline:
                 output, adding geographic coordinates. Defaults to ``True``.
             without_microtoponyms (bool, optional): Specifies whether to
                 exclude microtoponyms during processing. Defaults to ``False``.
+            mentions (List[dict], optional): The mentions already recognised
+                in the sentence (as returned by
+                :py:meth:`~geoparser.pipeline.Pipeline.run_sentence_recognition`).
+                If not provided, NER is run on the sentence. Defaults to
+                ``None``.
+            candidates (dict, optional): The candidates already selected
+                for (at least) the mentions in the sentence, as returned by
+                :py:meth:`~geoparser.ranking.Ranker.find_candidates`. If not
+                provided, candidate selection is run on the sentence's
+                mentions. Defaults to ``None``.
 
         Returns:
             List[dict]:
@@ -211,7 +242,8 @@ class Pipeline:
             ID.
         """
 
-        mentions = self.run_sentence_recognition(sentence)
+        if mentions is None:
+            mentions = self.run_sentence_recognition(sentence)
 
         # List of mentions for the ranker:
         rmentions = []
@@ -222,10 +254,15 @@ class Pipeline:
         else:
             rmentions = [{"mention": y["mention"]} for y in mentions]
 
-        # Perform candidate ranking:
-        wk_cands, self.myranker.already_collected_cands = self.myranker.find_candidates(
-            rmentions
-        )
+        # Perform candidate ranking, unless the candidates have already been
+        # selected (in which case, keep those of this sentence's mentions):
+        if candidates is None:
+            (
+                wk_cands,
+                self.myranker.already_collected_cands,
+            ) = self.myranker.find_candidates(rmentions)
+        else:
+            wk_cands = {m["mention"]: candidates[m["mention"]] for m in rmentions}
 
         mentions_dataset = dict()
         mentions_dataset["linking"] = []
@@ -268,37 +305,32 @@ class Pipeline:
                 # ... and if "publ", now remove the artificial publication entry!
                 mentions_dataset["linking"].pop()
 
-            for i in range(len(mentions_dataset["linking"])):
-                mentions_dataset["linking"][i]["prediction"] = predicted["linking"][i][
-                    "prediction"
-                ]
-                mentions_dataset["linking"][i]["ed_score"] = round(
-                    predicted["linking"][i]["conf_ed"], 3
-                )
+            # Bind each mention and its prediction once, rather than
+            # indexing into the datasets for every field:
+            for md, pred in zip(mentions_dataset["linking"], predicted["linking"]):
+                md["prediction"] = pred["prediction"]
+                md["ed_score"] = round(pred["conf_ed"], 3)
 
                 # Get cross-candidate confidence scores per candidate:
-                mentions_dataset["linking"][i]["cross_cand_score"] = {
+                cross_cand_score = {
                     cand: score
-                    for cand, score in zip(
-                        predicted["linking"][i]["candidates"],
-                        predicted["linking"][i]["scores"],
-                    )
+                    for cand, score in zip(pred["candidates"], pred["scores"])
                     if cand != "#UNK#"
                 }
 
                 # Sort candidates and round scores:
-                mentions_dataset["linking"][i]["cross_cand_score"] = {
+                md["cross_cand_score"] = {
                     k: round(v, 3)
                     for k, v in sorted(
-                        mentions_dataset["linking"][i]["cross_cand_score"].items(),
+                        cross_cand_score.items(),
                         key=lambda item: item[1],
                         reverse=True,
                     )
                 }
 
                 # Get string matching confidence scores per candidate:
-                dCs = mentions_dataset["linking"][i]["string_match_candidates"]
-                mentions_dataset["linking"][i]["string_match_score"] = {
+                dCs = md["string_match_candidates"]
+                md["string_match_score"] = {
                     x: (
                         round(dCs[x]["Score"], 3),
                         [wqc for wqc in dCs[x]["Candidates"]],
@@ -306,49 +338,52 @@ class Pipeline:
                     for x in dCs
                 }
                 # Get linking prior confidence scores per candidate:
-                mentions_dataset["linking"][i]["prior_cand_score"] = {
+                prior_cand_score = {
                     cand: score
-                    for cand, score in mentions_dataset["linking"][i]["candidates"]
-                    if cand in mentions_dataset["linking"][i]["cross_cand_score"]
+                    for cand, score in md["candidates"]
+                    if cand in md["cross_cand_score"]
                 }
 
                 # Sort candidates and round scores:
-                mentions_dataset["linking"][i]["prior_cand_score"] = {
+                md["prior_cand_score"] = {
                     k: round(v, 3)
                     for k, v in sorted(
-                        mentions_dataset["linking"][i]["prior_cand_score"].items(),
+                        prior_cand_score.items(),
                         key=lambda item: item[1],
                         reverse=True,
                     )
                 }
 
         if self.mylinker.method in ["mostpopular", "bydistance"]:
-            for i in range(len(mentions_dataset["linking"])):
-                mention = mentions_dataset["linking"][i]
-
-                # Run entity linking per mention:
-                selected_cand = self.mylinker.run(
+            # Run entity linking for all mentions at once:
+            selected_cands = self.mylinker.run_batch(
+                [
                     {
                         "candidates": wk_cands[mention["mention"]],
                         "place_wqid": place_wqid,
                     }
-                )
-                mentions_dataset["linking"][i]["prediction"] = selected_cand[0]
-                mentions_dataset["linking"][i]["ed_score"] = round(selected_cand[1], 3)
-                dCs = mentions_dataset["linking"][i]["string_match_candidates"]
-                mentions_dataset["linking"][i]["string_match_score"] = {
+                    for mention in mentions_dataset["linking"]
+                ]
+            )
+            for md, selected_cand in zip(mentions_dataset["linking"], selected_cands):
+                md["prediction"] = selected_cand.prediction
+                md["ed_score"] = round(selected_cand.score, 3)
+                dCs = md["string_match_candidates"]
+                md["string_match_score"] = {
                     x: (
                         round(dCs[x]["Score"], 3),
                         [wqc for wqc in dCs[x]["Candidates"]],
                     )
                     for x in dCs
                 }
-                mentions_dataset["linking"][i]["prior_cand_score"] = dict()
+                md["prior_cand_score"] = dict()
 
                 # Return candidates scores for top n=7 candidates
                 # (same returned by REL):
-                tmp_cands = {k: round(selected_cand[2][k], 3) for k in selected_cand[2]}
-                mentions_dataset["linking"][i]["cross_cand_score"] = dict(
+                tmp_cands = {
+                    k: round(v, 3) for k, v in selected_cand.candidates.items()
+                }
+                md["cross_cand_score"] = dict(
                     sorted(tmp_cands.items(), key=lambda x: x[1], reverse=True)[:7]
                 )
 
@@ -358,31 +393,7 @@ class Pipeline:
         if postprocess_output:
             # Process output, add coordinates and wikidata class from
             # prediction:
-            keys = [
-                "sent_idx",
-                "mention",
-                "pos",
-                "end_pos",
-                "tag",
-                "prediction",
-                "ner_score",
-                "ed_score",
-                "sentence",
-                "string_match_score",
-                "prior_cand_score",
-                "cross_cand_score",
-            ]
-            sentence_dataset = []
-            for md in mentions_dataset["linking"]:
-                md = dict((k, md[k]) for k in md if k in keys)
-                md["latlon"] = self.mylinker.linking_resources["wqid_to_coords"].get(
-                    md["prediction"]
-                )
-                md["wkdt_class"] = self.mylinker.linking_resources["entity2class"].get(
-                    md["prediction"]
-                )
-                sentence_dataset.append(md)
-            return sentence_dataset
+            return self.postprocess_linking(mentions_dataset["linking"])
 
     def run_text(
         self,
@@ -461,6 +472,25 @@ class Pipeline:
         # Split the text into its sentences:
         sentences = split_text_into_sentences(text, language="en")
 
+        # Run NER on all sentences at once:
+        all_mentions = self.run_sentences_recognition(sentences)
+
+        # Select the candidates of the mentions in all sentences at once, so
+        # that each unique mention is only ranked once:
+        without_microtoponyms = self.mylinker.rel_params.get(
+            "without_microtoponyms", False
+        )
+        all_rmentions = [
+            {"mention": y["mention"]}
+            for mentions in all_mentions
+            for y in mentions
+            if not without_microtoponyms or y["ner_label"] == "LOC"
+        ]
+        (
+            all_cands,
+            self.myranker.already_collected_cands,
+        ) = self.myranker.find_candidates(all_rmentions)
+
         document_dataset = []
         for idx, sentence in enumerate(sentences):
             # Get context (prev and next sentence)
@@ -478,9 +508,9 @@ class Pipeline:
                 place=place,
                 place_wqid=place_wqid,
                 postprocess_output=postprocess_output,
-                without_microtoponyms=self.mylinker.rel_params.get(
-                    "without_microtoponyms", False
-                ),
+                without_microtoponyms=without_microtoponyms,
+                mentions=all_mentions[idx],
+                candidates=all_cands,
             )
 
             # Collect results from all sentences:
@@ -493,6 +523,26 @@ class Pipeline:
         # Get predictions:
         predictions = self.myner.ner_predict(sentence)
 
+        return self.process_ner_predictions(predictions)
+
+    def run_sentences_recognition(self, sentences: List[str]) -> List[List[dict]]:
+        # Get predictions for all sentences at once, in batches:
+        all_predictions = self.myner.ner_predict_batch(sentences)
+
+        return [self.process_ner_predictions(p) for p in all_predictions]
+
+    def close(self) -> None:
+        """
+        Releases the resources held by the pipeline, i.e. the pool of worker
+        processes of the Recogniser (see
+        :py:meth:`~geoparser.recogniser.Recogniser.close`).
+
+        Returns:
+            None.
+        """
+        self.myner.close()
+
+    def process_ner_predictions(self, predictions: List[dict]) -> List[dict]:
         # Process predictions:
         procpreds = [
             [x["word"], x["entity"], "O", x["start"], x["end"], x["score"]]
@@ -583,7 +633,7 @@ class Pipeline:
 
         Note:
             The ``run_text_recognition`` method runs Named Entity Recognition
-            (NER) on a full text, one sentence at a time. It takes the input text
+            (NER) on a full text, in batches of sentences. It takes the input text
             (along with optional parameters like the place of publication
             and its related Wikidata ID) and splits it into sentences, and
             after that finds mentions for each sentence.
@@ -592,6 +642,9 @@ class Pipeline:
         # Split the text into its sentences:
         sentences = split_text_into_sentences(text, language="en")
 
+        # Run NER on all sentences at once:
+        all_mentions = self.run_sentences_recognition(sentences)
+
         document_dataset = []
         for idx, sentence in enumerate(sentences):
             # Get context (prev and next sentence)
@@ -601,7 +654,7 @@ class Pipeline:
             if idx + 1 < len(sentences):
                 context[1] = sentences[idx + 1]
 
-            mentions = self.run_sentence_recognition(sentence)
+            mentions = all_mentions[idx]
 
             mentions_dataset = []
             for m in mentions:
@@ -678,11 +731,9 @@ class Pipeline:
         else:
             rmentions = [y["mention"] for y in document_dataset]
 
-        # Make list of mentions unique:
-        mentions = list(set(rmentions))
-
-        # Prepare list of mentions as required by candidate selection and ranking:
-        mentions = [{"mention": m} for m in mentions]
+        # Prepare the list of unique mentions (in order of first appearance)
+        # as required by candidate selection and ranking:
+        mentions = [{"mention": m} for m in dict.fromkeys(rmentions)]
 
         # Perform candidate ranking:
         wk_cands, self.myranker.already_collected_cands = self.myranker.find_candidates(
@@ -776,37 +827,32 @@ class Pipeline:
                 # ... and if "publ", now remove the artificial publication entry!
                 mentions_dataset["linking"].pop()
 
-            for i in range(len(mentions_dataset["linking"])):
-                mentions_dataset["linking"][i]["prediction"] = predicted["linking"][i][
-                    "prediction"
-                ]
-                mentions_dataset["linking"][i]["ed_score"] = round(
-                    predicted["linking"][i]["conf_ed"], 3
-                )
+            # Bind each mention and its prediction once, rather than
+            # indexing into the datasets for every field:
+            for md, pred in zip(mentions_dataset["linking"], predicted["linking"]):
+                md["prediction"] = pred["prediction"]
+                md["ed_score"] = round(pred["conf_ed"], 3)
 
                 # Get cross-candidate confidence scores per candidate:
-                mentions_dataset["linking"][i]["cross_cand_score"] = {
+                cross_cand_score = {
                     cand: score
-                    for cand, score in zip(
-                        predicted["linking"][i]["candidates"],
-                        predicted["linking"][i]["scores"],
-                    )
+                    for cand, score in zip(pred["candidates"], pred["scores"])
                     if cand != "#UNK#"
                 }
 
                 # Sort candidates and round scores:
-                mentions_dataset["linking"][i]["cross_cand_score"] = {
+                md["cross_cand_score"] = {
                     k: round(v, 3)
                     for k, v in sorted(
-                        mentions_dataset["linking"][i]["cross_cand_score"].items(),
+                        cross_cand_score.items(),
                         key=lambda item: item[1],
                         reverse=True,
                     )
                 }
 
                 # Get string matching confidence scores per candidate:
-                dCs = mentions_dataset["linking"][i]["string_match_candidates"]
-                mentions_dataset["linking"][i]["string_match_score"] = {
+                dCs = md["string_match_candidates"]
+                md["string_match_score"] = {
                     x: (
                         round(dCs[x]["Score"], 3),
                         [wqc for wqc in dCs[x]["Candidates"]],
@@ -814,76 +860,79 @@ class Pipeline:
                     for x in dCs
                 }
                 # Get linking prior confidence scores per candidate:
-                mentions_dataset["linking"][i]["prior_cand_score"] = {
+                prior_cand_score = {
                     cand: score
-                    for cand, score in mentions_dataset["linking"][i]["candidates"]
-                    if cand in mentions_dataset["linking"][i]["cross_cand_score"]
+                    for cand, score in md["candidates"]
+                    if cand in md["cross_cand_score"]
                 }
 
                 # Sort candidates and round scores:
-                mentions_dataset["linking"][i]["prior_cand_score"] = {
+                md["prior_cand_score"] = {
                     k: round(v, 3)
                     for k, v in sorted(
-                        mentions_dataset["linking"][i]["prior_cand_score"].items(),
+                        prior_cand_score.items(),
                         key=lambda item: item[1],
                         reverse=True,
                     )
                 }
 
         if self.mylinker.method in ["mostpopular", "bydistance"]:
-            for i in range(len(mentions_dataset["linking"])):
-                mention = mentions_dataset["linking"][i]
-
-                # Run entity linking per mention:
-                selected_cand = self.mylinker.run(
+            # Run entity linking for all mentions at once:
+            selected_cands = self.mylinker.run_batch(
+                [
                     {
                         "candidates": wk_cands[mention["mention"]],
                         "place_wqid": "",
                     }
-                )
-                mentions_dataset["linking"][i]["prediction"] = selected_cand[0]
-                mentions_dataset["linking"][i]["ed_score"] = round(selected_cand[1], 3)
-                dCs = mentions_dataset["linking"][i]["string_match_candidates"]
-                mentions_dataset["linking"][i]["string_match_score"] = {
+                    for mention in mentions_dataset["linking"]
+                ]
+            )
+            for md, selected_cand in zip(mentions_dataset["linking"], selected_cands):
+                md["prediction"] = selected_cand.prediction
+                md["ed_score"] = round(selected_cand.score, 3)
+                dCs = md["string_match_candidates"]
+                md["string_match_score"] = {
                     x: (
                         round(dCs[x]["Score"], 3),
                         [wqc for wqc in dCs[x]["Candidates"]],
                     )
                     for x in dCs
                 }
-                mentions_dataset["linking"][i]["prior_cand_score"] = dict()
+                md["prior_cand_score"] = dict()
 
                 # Return candidates scores for top n=7 candidates
                 # (same returned by REL):
-                tmp_cands = {k: round(selected_cand[2][k], 3) for k in selected_cand[2]}
-                mentions_dataset["linking"][i]["cross_cand_score"] = dict(
+                tmp_cands = {
+                    k: round(v, 3) for k, v in selected_cand.candidates.items()
+                }
+                md["cross_cand_score"] = dict(
                     sorted(tmp_cands.items(), key=lambda x: x[1], reverse=True)[:7]
                 )
 
         # Process output, add coordinates and wikidata class from
         # prediction:
-        keys = [
-            "sent_idx",
-            "mention",
-            "pos",
-            "end_pos",
-            "tag",
-            "prediction",
-            "ner_score",
-            "ed_score",
-            "sentence",
-            "string_match_score",
-            "prior_cand_score",
-            "cross_cand_score",
-        ]
+        return self.postprocess_linking(mentions_dataset["linking"])
+
+    def postprocess_linking(self, linked_mentions: List[dict]) -> List[dict]:
+        """
+        Formats the output of the linking step: keeps only the output fields
+        of each mention and adds the coordinates and Wikidata class of its
+        predicted entity.
+
+        Arguments:
+            linked_mentions (List[dict]): The mentions, as returned by the
+                linking step.
+
+        Returns:
+            List[dict]: The postprocessed mentions.
+        """
+        wqid_to_coords = self.mylinker.linking_resources["wqid_to_coords"]
+        entity2class = self.mylinker.linking_resources["entity2class"]
+
         sentence_dataset = []
-        for md in mentions_dataset["linking"]:
-            md = dict((k, md[k]) for k in md if k in keys)
-            md["latlon"] = self.mylinker.linking_resources["wqid_to_coords"].get(
-                md["prediction"]
-            )
-            md["wkdt_class"] = self.mylinker.linking_resources["entity2class"].get(
-                md["prediction"]
-            )
+        for md in linked_mentions:
+            md = {k: v for k, v in md.items() if k in OUTPUT_KEYS}
+            md["latlon"] = wqid_to_coords.get(md["prediction"])
+            md["wkdt_class"] = entity2class.get(md["prediction"])
             sentence_dataset.append(md)
         return sentence_dataset
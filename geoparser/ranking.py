@@ -1,18 +1,111 @@
-import json
+import mmap
 import os
+import pickle
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
-from typing import List, Literal, Optional, Tuple
+from typing import Dict, List, Literal, Optional, Tuple
 
+import orjson
 import pandas as pd
 from DeezyMatch import candidate_ranker
-from pandarallel import pandarallel
 from pyxdameraulevenshtein import normalized_damerau_levenshtein_distance
 
 # Add "../" to path to import utils
-sys.path.insert(0, os.path.abspath(os.path.pardir))
+if os.path.abspath(os.path.pardir) not in sys.path:
+    sys.path.insert(0, os.path.abspath(os.path.pardir))
 from utils import deezy_processing
 
+# Substrings that mark a Wikipedia mention as noisy (e.g. "Paris, Texas" or
+# "Paris (mythology)"), see :py:meth:`~geoparser.ranking.Ranker.filter_mentions`.
+# They are also stored with the cached filtered mentions, which are rebuilt
+# when they change:
+NOISY_MENTION_PATTERNS = (", ", " (")
+
+# Partial matching compares each query with every known mention. The
+# mentions are split into (at most) this many chunks, scored in separate
+# processes, but only if each chunk has at least the given number of mentions:
+PARTIAL_MATCH_WORKERS = 10
+PARTIAL_MATCH_MIN_CHUNK_SIZE = 50_000
+
+
+def load_json(path: str) -> dict:
+    """
+    Load a (large) JSON resource file.
+
+    Arguments:
+        path (str): The path to the JSON file.
+
+    Returns:
+        dict: The parsed content of the file.
+
+    Note:
+        The file is memory-mapped and parsed directly with ``orjson``, so
+        that its content is not first copied into a ``bytes`` object, which
+        would double the peak memory used while loading the resources.
+    """
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as view:
+                return orjson.loads(view)
+
+
+def top_partial_matches(
+    queries: List[str], mentions: List[str], damlev: bool
+) -> Dict[str, Tuple[Optional[float], List[str]]]:
+    """
+    Find, for each query, the mentions that match it best, either by
+    Damerau-Levenshtein similarity or by containment (see
+    :py:meth:`~geoparser.ranking.Ranker.damlev_dist` and
+    :py:meth:`~geoparser.ranking.Ranker.check_if_contained`).
+
+    Arguments:
+        queries (list): A list of mentions (strings) identified in a text.
+        mentions (list): A list of mentions in the knowledge base.
+        damlev (bool): Whether to use the Damerau-Levenshtein similarity
+            (True) or containment-based matching (False).
+
+    Returns:
+        Dict[str, Tuple[Optional[float], List[str]]]:
+            A dictionary mapping each query to a tuple of its highest match
+            score (``None`` if no mention matches) and the list of mentions
+            with that score.
+
+    Note:
+        This is a module-level function so that chunks of mentions can be
+        scored in separate processes by
+        :py:meth:`~geoparser.ranking.Ranker.partial_match`.
+    """
+    lowered_mentions = [m.lower() for m in mentions]
+
+    matches = dict()
+    for query in queries:
+        lowered_query = query.lower()
+        best_score = None
+        best_mentions = []
+        for mention, lowered_mention in zip(mentions, lowered_mentions):
+            if damlev:
+                score = 1.0 - normalized_damerau_levenshtein_distance(
+                    lowered_query, lowered_mention
+                )
+            elif lowered_query in lowered_mention:
+                score = len(query) / len(mention)
+            elif lowered_mention in lowered_query:
+                score = len(mention) / len(query)
+            else:
+                continue
+
+            if best_score is None or score > best_score:
+                best_score = score
+                best_mentions = [mention]
+            elif score == best_score:
+                best_mentions.append(mention)
+
+        matches[query] = (best_score, best_mentions)
+
+    return matches
+
 
 class Ranker:
     """
@@ -186,75 +279,135 @@ class Ranker:
                 normalized "relevance", i.e. number of in-links across Wikipedia.
 
         Note:
-            This method loads the mentions-to-wikidata and
-            wikidata-to-mentions dictionaries from the resources directory,
-            specified when initialising the
-            :py:meth:`~geoparser.ranking.Ranker`. They are required for
+            This method loads the wikidata-to-mentions dictionary from the
+            resources directory, specified when initialising the
+            :py:meth:`~geoparser.ranking.Ranker`, and derives the
+            mentions-to-wikidata dictionary from it. They are required for
             performing candidate selection and ranking.
 
-            It filters the dictionaries to remove noise and updates the class
-            attributes accordingly.
+            It filters the dictionaries to remove noise (see
+            :py:meth:`~geoparser.ranking.Ranker.filter_mentions`) and updates
+            the class attributes accordingly. The filtered dictionaries are
+            cached in a pickle file next to the original JSON file, which is
+            used instead on subsequent runs, as long as it is up to date.
 
-            The method also initialises ``pandarallel`` if needed by the
-            candidate ranking method (if the ``method`` set in the initialiser
-            of the ``Ranker`` was set to "partialmatch" or "levenshtein").
         """
         print("*** Loading the ranker resources.")
 
-        # Load files
+        # Load files. Note that the mentions-to-wikidata dictionary is
+        # derived from the filtered wikidata-to-mentions dictionary, so there
+        # is no need to also parse it from disk:
         files = {
-            "mentions_to_wikidata": f"{self.resources_path}mentions_to_wikidata_normalized.json",
             "wikidata_to_mentions": f"{self.resources_path}wikidata_to_mentions_normalized.json",
         }
 
-        with open(files["mentions_to_wikidata"], "r") as f:
-            self.mentions_to_wikidata = json.load(f)
+        # The filtered dictionaries are cached as a pickle next to the JSON
+        # file, and rebuilt whenever the JSON file is newer than the cache or
+        # the cache was built with different noisy mention patterns:
+        cache_path = (
+            os.path.splitext(files["wikidata_to_mentions"])[0] + "_filtered.pkl"
+        )
+        cached = None
+        if os.path.exists(cache_path) and os.path.getmtime(
+            cache_path
+        ) >= os.path.getmtime(files["wikidata_to_mentions"]):
+            # A cache that cannot be read (e.g. corrupted, or written by other
+            # versions of Python) is rebuilt rather than failing every run:
+            try:
+                with open(cache_path, "rb") as f:
+                    cached = pickle.load(f)
+            except (pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+                print(f"  > The cached filtered mentions could not be read: {e}")
+            if cached is not None and (
+                len(cached) != 3 or cached[0] != NOISY_MENTION_PATTERNS
+            ):
+                cached = None
+
+        if cached is not None:
+            print("  > Loading filtered mentions from cache.")
+            _, self.mentions_to_wikidata, self.wikidata_to_mentions = cached
+        else:
+            self.wikidata_to_mentions = load_json(files["wikidata_to_mentions"])
+
+            (
+                self.mentions_to_wikidata,
+                self.wikidata_to_mentions,
+            ) = self.filter_mentions(self.wikidata_to_mentions)
+
+            # Write the cache to a temporary file first, so that an interrupted
+            # run never leaves a truncated (but fresh-looking) cache behind:
+            try:
+                with open(cache_path + ".tmp", "wb") as f:
+                    pickle.dump(
+                        (
+                            NOISY_MENTION_PATTERNS,
+                            self.mentions_to_wikidata,
+                            self.wikidata_to_mentions,
+                        ),
+                        f,
+                        protocol=pickle.HIGHEST_PROTOCOL,
+                    )
+                os.replace(cache_path + ".tmp", cache_path)
+            except OSError as e:
+                print(f"  > The filtered mentions could not be cached: {e}")
+
+        # Partial matching is parallelised across processes:
+        if self.method in ["partialmatch", "levenshtein"]:
+            os.environ["TOKENIZERS_PARALLELISM"] = "true"
 
-        with open(files["wikidata_to_mentions"], "r") as f:
-            self.wikidata_to_mentions = json.load(f)
+        return self.mentions_to_wikidata
 
-        # Filter mentions to remove noise:
-        wikidata_to_mentions_filtered = dict()
-        mentions_to_wikidata_filtered = dict()
-        for wk in self.wikidata_to_mentions:
-            wikipedia_mentions = self.wikidata_to_mentions.get(wk)
-            wikipedia_mentions_stripped = dict(
-                [
-                    (x, wikipedia_mentions[x])
-                    for x in wikipedia_mentions
-                    if not ", " in x and not " (" in x
-                ]
-            )
+    def filter_mentions(self, wikidata_to_mentions: dict) -> Tuple[dict, dict]:
+        """
+        Filter the mentions of each Wikidata entity to remove noise, i.e.
+        mentions that contain any of ``NOISY_MENTION_PATTERNS`` (unless this
+        would leave the entity without mentions), and invert the result.
 
-            if wikipedia_mentions_stripped:
-                wikipedia_mentions = wikipedia_mentions_stripped
+        Arguments:
+            wikidata_to_mentions (dict): A dictionary mapping Wikidata IDs to
+                their mentions on Wikipedia, and their normalized relevance.
 
-            wikidata_to_mentions_filtered[wk] = dict(
-                [(x, wikipedia_mentions[x]) for x in wikipedia_mentions]
-            )
+        Returns:
+            Tuple[dict, dict]: A tuple containing two dictionaries:
 
-            for m in wikidata_to_mentions_filtered[wk]:
+                #. The filtered mentions-to-wikidata dictionary.
+                #. The filtered wikidata-to-mentions dictionary.
+        """
+        # Filter mentions in a single pass over the wikidata-to-mentions
+        # dictionary, inverting it at the same time:
+        wikidata_to_mentions_filtered = dict()
+        mentions_to_wikidata_filtered = dict()
+        for wk, wikipedia_mentions in wikidata_to_mentions.items():
+            # Scan all mentions of the entity at once first, and only filter
+            # them one by one if a noisy pattern occurs in any of them (the
+            # "\n" separator prevents matches across two mentions). The
+            # patterns are tested in plain loops, as a generator per entity or
+            # mention would be several times slower:
+            all_mentions = "\n".join(wikipedia_mentions)
+            for noisy_pattern in NOISY_MENTION_PATTERNS:
+                if noisy_pattern in all_mentions:
+                    wikipedia_mentions_stripped = dict()
+                    for x, score in wikipedia_mentions.items():
+                        for p in NOISY_MENTION_PATTERNS:
+                            if p in x:
+                                break
+                        else:
+                            wikipedia_mentions_stripped[x] = score
+
+                    # Keep all mentions if none is left after filtering:
+                    if wikipedia_mentions_stripped:
+                        wikipedia_mentions = wikipedia_mentions_stripped
+                    break
+
+            wikidata_to_mentions_filtered[wk] = wikipedia_mentions
+
+            for m, score in wikipedia_mentions.items():
                 if m in mentions_to_wikidata_filtered:
-                    mentions_to_wikidata_filtered[m][
-                        wk
-                    ] = wikidata_to_mentions_filtered[wk][m]
+                    mentions_to_wikidata_filtered[m][wk] = score
                 else:
-                    mentions_to_wikidata_filtered[m] = {
-                        wk: wikidata_to_mentions_filtered[wk][m]
-                    }
-
-        self.mentions_to_wikidata = mentions_to_wikidata_filtered
-        self.wikidata_to_mentions = wikidata_to_mentions_filtered
-
-        del mentions_to_wikidata_filtered
-        del wikidata_to_mentions_filtered
-
-        # Parallelize if ranking method is one of the following:
-        if self.method in ["partialmatch", "levenshtein"]:
-            pandarallel.initialize(nb_workers=10)
-            os.environ["TOKENIZERS_PARALLELISM"] = "true"
+                    mentions_to_wikidata_filtered[m] = {wk: score}
 
-        return self.mentions_to_wikidata
+        return mentions_to_wikidata_filtered, wikidata_to_mentions_filtered
 
     def train(self) -> None:
         """
@@ -433,6 +586,8 @@ class Ranker:
             partial matching process for that mention. For the remaining
             mentions, it calculates the match score based on the specified
             partial matching method: Levenshtein distance or containment.
+            The known mentions are scored in chunks, in separate processes
+            if there are many of them (see :py:func:`top_partial_matches`).
 
         """
 
@@ -441,30 +596,55 @@ class Ranker:
         # the rest go through
         remainers = [x for x, y in candidates.items() if len(y) == 0]
 
-        for query in remainers:
-            mention_df = pd.DataFrame({"mentions": self.mentions_to_wikidata.keys()})
+        if not remainers:
+            return candidates, self.already_collected_cands
 
-            if damlev:
-                mention_df["score"] = mention_df.parallel_apply(
-                    lambda row: self.damlev_dist(query, row), axis=1
-                )
-            else:
-                mention_df["score"] = mention_df.parallel_apply(
-                    lambda row: self.check_if_contained(query, row), axis=1
+        # Score all remaining queries against chunks of the known mentions,
+        # in parallel if there are enough of them, so that each chunk is
+        # sent to a worker process only once for all queries:
+        mentions = list(self.mentions_to_wikidata.keys())
+        nb_chunks = min(
+            PARTIAL_MATCH_WORKERS,
+            max(1, len(mentions) // PARTIAL_MATCH_MIN_CHUNK_SIZE),
+        )
+        if nb_chunks == 1:
+            chunk_matches = [top_partial_matches(remainers, mentions, damlev)]
+        else:
+            chunk_size = -(-len(mentions) // nb_chunks)
+            chunks = [
+                mentions[i : i + chunk_size]
+                for i in range(0, len(mentions), chunk_size)
+            ]
+            with ProcessPoolExecutor(max_workers=len(chunks)) as executor:
+                chunk_matches = list(
+                    executor.map(
+                        top_partial_matches,
+                        repeat(remainers),
+                        chunks,
+                        repeat(damlev),
+                    )
                 )
 
-            mention_df = mention_df.dropna()
-
-            # currently hardcoded cutoff
-            top_scores = sorted(
-                list(set(list(mention_df["score"].unique()))), reverse=True
-            )[:1]
-            mention_df = mention_df[mention_df["score"].isin(top_scores)]
-            mention_df = mention_df.set_index("mentions").to_dict()["score"]
-
-            candidates[query] = mention_df
-
-            self.already_collected_cands[query] = mention_df
+        for query in remainers:
+            # Keep the mentions with the highest score across all chunks
+            # (currently hardcoded cutoff):
+            top_score = None
+            top_mentions = []
+            for matches in chunk_matches:
+                score, best_mentions = matches[query]
+                if score is None:
+                    continue
+                if top_score is None or score > top_score:
+                    top_score = score
+                    top_mentions = list(best_mentions)
+                elif score == top_score:
+                    top_mentions.extend(best_mentions)
+
+            query_candidates = {mention: top_score for mention in top_mentions}
+
+            candidates[query] = query_candidates
+
+            self.already_collected_cands[query] = query_candidates
 
         return candidates, self.already_collected_cands
 
@@ -670,36 +850,82 @@ class Ranker:
             dictionary (the Ranker object's ``already_collected_cands``
             attribute).
         """
-        # Extract the mention
-        queries = list(set([mention["mention"] for mention in mentions]))
+        # Extract the unique mentions, in the order in which they first
+        # appear (without building an intermediate list):
+        queries = list(dict.fromkeys(mention["mention"] for mention in mentions))
 
         # Pass the mentions to :py:meth:`geoparser.ranking.Ranker.run`
         cands, self.already_collected_cands = self.run(queries)
 
-        # Get Wikidata candidates
+        # Get Wikidata candidates (looking up each mention's collected
+        # candidates once, rather than once per variation):
+        mentions_to_wikidata = self.mentions_to_wikidata
         wk_cands = dict()
-        for original_mention in cands:
-            wk_cands[original_mention] = dict()
-            for variation in cands[original_mention]:
+        for original_mention, variations in cands.items():
+            mention_cands = dict()
+            collected_cands = self.already_collected_cands[original_mention]
+            for variation, match_score in variations.items():
                 # If the candidates of the variation of the original mention
                 # have already been stored, reuse them:
-                stored_value = self.already_collected_cands[original_mention][variation]
+                stored_value = collected_cands[variation]
                 if type(stored_value) == dict:
-                    wk_cands[original_mention][variation] = stored_value
+                    mention_cands[variation] = stored_value
                 # If the candidates of the variation of the original mention
                 # have not yet been found, find them:
                 else:
-                    match_score = cands[original_mention][variation]
                     # Find Wikidata ID and relv.
-                    found_cands = self.mentions_to_wikidata.get(variation, dict())
-                    if found_cands and not variation in wk_cands[original_mention]:
-                        wk_cands[original_mention][variation] = {
+                    found_cands = mentions_to_wikidata.get(variation, dict())
+                    if found_cands and not variation in mention_cands:
+                        mention_cands[variation] = {
                             "Score": match_score,
                             "Candidates": found_cands,
                         }
-                        self.already_collected_cands[original_mention][variation] = {
+                        collected_cands[variation] = {
                             "Score": match_score,
                             "Candidates": found_cands,
                         }
+            wk_cands[original_mention] = mention_cands
 
         return wk_cands, self.already_collected_cands
+
+    def find_candidates_batch(
+        self, mentions_lists: List[List[dict]]
+    ) -> Tuple[List[dict], dict]:
+        """
+        Find candidates for several lists of mentions (e.g. the mentions of
+        each sentence of a document) at once, using the selected ranking
+        method.
+
+        Arguments:
+            mentions_lists (list): A list of lists of predicted mentions as
+                dictionaries.
+
+        Returns:
+            Tuple[List[dict], dict]: A tuple containing:
+
+            #. A list with one dictionary per list of mentions, in the same
+               order as ``mentions_lists``, in the format of the first
+               dictionary returned by
+               :py:meth:`~geoparser.ranking.Ranker.find_candidates`.
+            #. The dictionary of already collected candidates for each query.
+
+        Note:
+            All mentions are flattened into a single list and passed to
+            :py:meth:`~geoparser.ranking.Ranker.find_candidates` in one
+            call, so that each unique mention is only ranked once and, if
+            ``method`` is ``"deezymatch"``, DeezyMatch is run on all the
+            remaining queries at once rather than on a handful of them at a
+            time. The candidates are then split back per list of mentions.
+        """
+        all_mentions = [mention for mentions in mentions_lists for mention in mentions]
+        all_wk_cands, self.already_collected_cands = self.find_candidates(all_mentions)
+
+        wk_cands_lists = [
+            {
+                mention["mention"]: all_wk_cands[mention["mention"]]
+                for mention in mentions
+            }
+            for mentions in mentions_lists
+        ]
+
+        return wk_cands_lists, self.already_collected_cands
@@ -1,10 +1,13 @@
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from functools import partial
+from itertools import chain
 from pathlib import Path
 from typing import List, Optional, Tuple
 
 import numpy as np
+import torch
 from datasets import load_dataset, load_metric
 from transformers import (
     AutoModelForTokenClassification,
@@ -17,9 +20,46 @@ from transformers import (
 )
 
 # Add "../" to path to import utils
-sys.path.insert(0, os.path.abspath(os.path.pardir))
+if os.path.abspath(os.path.pardir) not in sys.path:
+    sys.path.insert(0, os.path.abspath(os.path.pardir))
 from utils import ner
 
+# Number of sentences passed through the NER model at once, when the
+# pipeline is given a list of sentences:
+NER_BATCH_SIZE = 32
+
+
+def postprocess_ner_predictions(ner_preds: List[dict], sentence: str) -> List[dict]:
+    """
+    Post-processes the raw output of the NER pipeline for a sentence,
+    fixing potential grouping errors.
+
+    Arguments:
+        ner_preds (List[dict]): The raw predictions of the NER pipeline.
+        sentence (str): The (prepared) sentence the predictions refer to.
+
+    Returns:
+        List[dict]:
+            The post-processed predictions, as returned by
+            :py:meth:`~geoparser.recogniser.Recogniser.ner_predict`.
+
+    Note:
+        This is a module-level function so that it can be sent to the
+        worker processes used by
+        :py:meth:`~geoparser.recogniser.Recogniser.ner_predict_batch`.
+    """
+    lEntities = []
+    predictions = []
+    for pred_ent in ner_preds:
+        pred_ent["score"] = float(pred_ent["score"])
+        pred_ent = ner.fix_capitalization(pred_ent, sentence)
+        predictions = ner.aggregate_entities(pred_ent, lEntities)
+
+    if len(predictions) > 0:
+        predictions = ner.fix_labels(predictions)
+
+    return predictions
+
 
 class Recogniser:
     """
@@ -47,6 +87,20 @@ class Recogniser:
             (default: ``False``).
         load_from_hub (bool, optional): Whether to load the model from
             HuggingFace model hub or locally (default: ``False``).
+        half_precision (bool, optional): Whether to run the NER model in
+            half precision (FP16) for inference. Only used when the model
+            runs on a GPU (default: ``False``).
+        quantize (bool, optional): Whether to apply dynamic int8
+            quantization to the linear layers of the NER model for
+            inference. Only used when the model runs on the CPU (default:
+            ``False``).
+        compile_model (bool, optional): Whether to compile the NER model
+            with ``torch.compile`` for inference, which requires PyTorch 2.0
+            or later (default: ``False``).
+        postprocess_workers (int, optional): The number of worker processes
+            used to post-process the predictions of
+            :py:meth:`~geoparser.recogniser.Recogniser.ner_predict_batch`, or
+            ``0`` to post-process them in the main process (default: ``0``).
 
     Example:
         >>> # Create an instance of the Recogniser class
@@ -96,6 +150,10 @@ class Recogniser:
         overwrite_training: Optional[bool] = False,
         do_test: Optional[bool] = False,
         load_from_hub: Optional[bool] = False,
+        half_precision: Optional[bool] = False,
+        quantize: Optional[bool] = False,
+        compile_model: Optional[bool] = False,
+        postprocess_workers: Optional[int] = 0,
     ):
         """
         Initialises a Recogniser object.
@@ -110,6 +168,13 @@ class Recogniser:
         self.overwrite_training = overwrite_training
         self.do_test = do_test
         self.load_from_hub = load_from_hub
+        self.half_precision = half_precision
+        self.quantize = quantize
+        self.compile_model = compile_model
+        self.postprocess_workers = postprocess_workers
+        # Pool of worker processes for post-processing, created the first
+        # time it is needed and reused across calls:
+        self.postprocess_pool = None
 
         # Add "_test" to the model name if do_test is True, unless
         # the model is downloaded from Huggingface, in which case
@@ -204,11 +269,9 @@ class Recogniser:
         print("Train:", len(lwm_train))
         print("Test:", len(lwm_test))
 
-        # Obtain unique list of labels:
-        df_tmp = lwm_train.to_pandas()
-        label_list = sorted(
-            list(set([tag for tags in df_tmp["ner_tags"] for tag in tags]))
-        )
+        # Obtain unique list of labels (only reading the tags column, rather
+        # than converting the whole training set to a dataframe):
+        label_list = tuple(sorted(set(chain.from_iterable(lwm_train["ner_tags"]))))
 
         # Create mapping between labels and ids:
         id2label = dict()
@@ -249,14 +312,18 @@ class Recogniser:
             predictions, labels = p
             predictions = np.argmax(predictions, axis=2)
 
+            # Convert the arrays to lists once, so that labels are looked up
+            # with Python integers rather than NumPy scalars:
+            predictions = predictions.tolist()
+            labels = labels.tolist()
+
             # Remove ignored index (special tokens)
             true_predictions = [
                 [label_list[p] for (p, l) in zip(prediction, label) if l != -100]
                 for prediction, label in zip(predictions, labels)
             ]
             true_labels = [
-                [label_list[l] for (p, l) in zip(prediction, label) if l != -100]
-                for prediction, label in zip(predictions, labels)
+                [label_list[l] for l in label if l != -100] for label in labels
             ]
 
             results = metric.compute(
@@ -314,6 +381,17 @@ class Recogniser:
             model hub or from a local path) to initialise the pipeline.
             The created pipeline is stored in the ``pipe`` attribute of the
             ``Recogniser`` object. It is also returned by the method.
+
+            The pipeline runs on the first GPU if one is available, and on
+            the CPU otherwise. Lists of sentences given to the pipeline are
+            run through the model in batches of ``NER_BATCH_SIZE``. On the
+            GPU, the model weights are cast to half precision if
+            ``half_precision`` was set to ``True``. On the CPU, the weights
+            of its linear layers are quantized to int8 if ``quantize`` was
+            set to ``True``. If ``compile_model`` was set to ``True`` (and
+            PyTorch supports it), the model is compiled with
+            ``torch.compile``, which fuses the operations of its forward
+            pass.
         """
 
         print("*** Creating and loading a NER pipeline.")
@@ -327,8 +405,54 @@ class Recogniser:
         if self.load_from_hub == False:
             model_name = self.model_path + self.model + ".model"
 
+        # Run the model on the GPU if there is one:
+        device = 0 if torch.cuda.is_available() else -1
+
         # Load a NER pipeline:
-        self.pipe = pipeline("ner", model=model_name, ignore_labels=[])
+        self.pipe = pipeline(
+            "ner",
+            model=model_name,
+            ignore_labels=[],
+            device=device,
+            batch_size=NER_BATCH_SIZE,
+        )
+
+        # Halve the memory traffic of the forward pass on the GPU (many
+        # operations are not supported in half precision on the CPU, where
+        # the model is kept in full precision):
+        if self.half_precision:
+            if device >= 0:
+                self.pipe.model.half()
+            else:
+                print(
+                    "Warning: half precision is only used on the GPU, the NER "
+                    "model will run in full precision on the CPU."
+                )
+
+        # Run the linear layers (most of the computation of the model) with
+        # int8 weights on the CPU:
+        if self.quantize:
+            if device < 0:
+                self.pipe.model = torch.quantization.quantize_dynamic(
+                    self.pipe.model, {torch.nn.Linear}, dtype=torch.qint8
+                )
+            else:
+                print(
+                    "Warning: dynamic quantization is only used on the CPU, the "
+                    "NER model will not be quantized on the GPU."
+                )
+
+        # Fuse the operations of the forward pass (only available from
+        # PyTorch 2.0 onwards):
+        if self.compile_model:
+            if hasattr(torch, "compile"):
+                self.pipe.model = torch.compile(self.pipe.model)
+            else:
+                print(
+                    "Warning: torch.compile is not available in this version "
+                    "of PyTorch, the NER model will not be compiled."
+                )
+
         return self.pipe
 
     # -------------------------------------------------------------
@@ -370,29 +494,131 @@ class Recogniser:
         if len(sentence) <= 1:
             return []
 
+        sentence = self.prepare_sentence(sentence)
+
+        # Run the NER pipeline to predict mentions:
+        ner_preds = self.pipe(sentence)
+
+        return self.postprocess_predictions(ner_preds, sentence)
+
+    def ner_predict_batch(
+        self, sentences: List[str], batch_size: Optional[int] = NER_BATCH_SIZE
+    ) -> List[List[dict]]:
+        """
+        Predicts named entities in a list of sentences using the NER
+        pipeline, running the model on batches of sentences rather than on
+        one sentence at a time.
+
+        Arguments:
+            sentences (List[str]): The input sentences.
+            batch_size (int, optional): The number of sentences passed
+                through the model at once. Defaults to ``NER_BATCH_SIZE``.
+
+        Returns:
+            List[List[dict]]:
+                A list with, for each input sentence (in the same order), the
+                list of predicted named entities, in the same format as
+                returned by
+                :py:meth:`~geoparser.recogniser.Recogniser.ner_predict`.
+        """
+        predictions = [[] for _ in sentences]
+
+        # Sentences that are too short are not passed to the model:
+        to_predict = [i for i, sentence in enumerate(sentences) if len(sentence) > 1]
+        prepared = [self.prepare_sentence(sentences[i]) for i in to_predict]
+        if not prepared:
+            return predictions
+
+        # Run the NER pipeline to predict mentions for all sentences:
+        all_ner_preds = self.pipe(prepared, batch_size=batch_size)
+
+        # Post-process the predictions, in the pool of worker processes if
+        # there is one, sending them to the workers in chunks:
+        if self.postprocess_workers:
+            if self.postprocess_pool is None:
+                self.postprocess_pool = ProcessPoolExecutor(
+                    max_workers=self.postprocess_workers
+                )
+            chunksize = max(1, len(prepared) // (4 * self.postprocess_workers))
+            all_predictions = self.postprocess_pool.map(
+                postprocess_ner_predictions,
+                all_ner_preds,
+                prepared,
+                chunksize=chunksize,
+            )
+        else:
+            all_predictions = map(postprocess_ner_predictions, all_ner_preds, prepared)
+
+        for i, sentence_predictions in zip(to_predict, all_predictions):
+            predictions[i] = sentence_predictions
+
+        return predictions
+
+    def close(self) -> None:
+        """
+        Shuts down the pool of worker processes used to post-process the
+        predictions of
+        :py:meth:`~geoparser.recogniser.Recogniser.ner_predict_batch`, if
+        there is one.
+
+        Returns:
+            None.
+
+        Note:
+            The pool is started on first use and kept until this method is
+            called (or the Recogniser is used as a context manager and its
+            block exits). On Linux, its workers are forked from the main
+            process, which holds the ``torch`` and ``transformers`` state.
+
+            The Recogniser can still be used after it has been closed: a new
+            pool of worker processes is started the next time one is needed.
+        """
+        if self.postprocess_pool is not None:
+            self.postprocess_pool.shutdown()
+            self.postprocess_pool = None
+
+    def __enter__(self) -> "Recogniser":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def prepare_sentence(self, sentence: str) -> str:
+        """
+        Prepares a sentence before passing it to the NER pipeline.
+
+        Arguments:
+            sentence (str): The input sentence.
+
+        Returns:
+            str: The prepared sentence.
+        """
         # The n-dash is a very frequent character in historical newspapers,
         # but the NER pipeline does not process it well: Plymouth—Kingston
         # is parsed as "Plymouth (B-LOC), — (B-LOC), Kingston (B-LOC)", instead
         # of the n-dash being interpreted as a word separator. Therefore, we
         # replace it by a comma, except when the n-dash occurs in the opening
         # position of a sentence.
-        sentence = sentence[0] + sentence[1:].replace("—", ",")
+        return sentence[0] + sentence[1:].replace("—", ",")
 
-        # Run the NER pipeline to predict mentions:
-        ner_preds = self.pipe(sentence)
+    def postprocess_predictions(
+        self, ner_preds: List[dict], sentence: str
+    ) -> List[dict]:
+        """
+        Post-processes the raw output of the NER pipeline for a sentence,
+        fixing potential grouping errors.
 
-        # Post-process the predictions, fixing potential grouping errors:
-        lEntities = []
-        predictions = []
-        for pred_ent in ner_preds:
-            pred_ent["score"] = float(pred_ent["score"])
-            pred_ent["entity"] = pred_ent["entity"]
-            pred_ent = ner.fix_capitalization(pred_ent, sentence)
-            predictions = ner.aggregate_entities(pred_ent, lEntities)
+        Arguments:
+            ner_preds (List[dict]): The raw predictions of the NER pipeline.
+            sentence (str): The (prepared) sentence the predictions refer to.
 
-        if len(predictions) > 0:
-            predictions = ner.fix_hyphens(predictions)
-            predictions = ner.fix_nested(predictions)
-            predictions = ner.fix_startEntity(predictions)
+        Returns:
+            List[dict]:
+                The post-processed predictions, as returned by
+                :py:meth:`~geoparser.recogniser.Recogniser.ner_predict`.
 
-        return predictions
+        Note:
+            This is a wrapper around
+            :py:func:`~geoparser.recogniser.postprocess_ner_predictions`.
+        """
+        return postprocess_ner_predictions(ner_preds, sentence)
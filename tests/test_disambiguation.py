@@ -3,6 +3,7 @@ import sqlite3
 import sys
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 
 # Add "../" to path to import utils
@@ -42,6 +43,97 @@ def test_embeddings():
         mentions = ["Q1"]
         embs = rel_utils.get_db_emb(cursor, mentions, "entity")
         assert embs == [None]
+        # Test 3: Check embeddings retrieved from preprocessed keys
+        mentions = ["Apple", "in", "apple"]
+        mention_keys = rel_utils.preprocess_db_emb_keys(mentions, "word")
+        assert mention_keys == {"Apple": "apple", "in": "in", "apple": "apple"}
+        embs = rel_utils.get_db_emb_by_key(cursor, list(mention_keys.values()))
+        assert np.array_equal(
+            embs[0], rel_utils.get_db_emb(cursor, mentions, "word")[2]
+        )
+        mention_keys = rel_utils.preprocess_db_emb_keys(
+            ["Q84", "#ENTITY/UNK#"], "entity"
+        )
+        assert list(mention_keys.values()) == ["ENTITY/Q84", "#ENTITY/UNK#"]
+
+
+def test_export_embeddings(tmp_path):
+    """
+    Test embeddings exported from the database are the same as in the database.
+    """
+    db_file = str(tmp_path / "embeddings_database.db")
+    embs = {
+        "in": np.arange(300, dtype=np.float32),
+        "#WORD/UNK#": np.ones(300, dtype=np.float32),
+        "ENTITY/Q84": np.full(300, 0.5, dtype=np.float32),
+    }
+    with sqlite3.connect(db_file) as conn:
+        conn.execute("CREATE TABLE entity_embeddings (word TEXT, emb BLOB)")
+        conn.executemany(
+            "INSERT INTO entity_embeddings VALUES (?, ?)",
+            [(word, emb.tobytes()) for word, emb in embs.items()],
+        )
+    mentions = ["In", "apple", "#SND/UNK#", "in"]
+    with sqlite3.connect(db_file) as conn:
+        cursor = conn.cursor()
+        db_word_embs = rel_utils.get_db_emb(cursor, mentions, "word")
+        db_entity_embs = rel_utils.get_db_emb(cursor, ["Q84", "Q1"], "entity")
+        matrix_path, words_path = rel_utils.export_db_emb(db_file)
+        assert os.path.exists(matrix_path) and os.path.exists(words_path)
+        assert not os.path.exists(matrix_path + ".tmp")
+        assert not os.path.exists(words_path + ".tmp")
+        # Make sure the embeddings are not taken from the cache:
+        rel_utils.EMB_CACHE.clear()
+        exported_word_embs = rel_utils.get_db_emb(cursor, mentions, "word")
+        exported_entity_embs = rel_utils.get_db_emb(cursor, ["Q84", "Q1"], "entity")
+    # The embeddings are read from the memory-mapped export:
+    assert isinstance(exported_word_embs[0].base, np.memmap)
+    assert isinstance(exported_entity_embs[0].base, np.memmap)
+    assert not isinstance(db_word_embs[0].base, np.memmap)
+    # The embeddings are shared between calls, so they cannot be modified:
+    assert not db_word_embs[0].flags.writeable
+    assert not exported_word_embs[0].flags.writeable
+    for db_embs, exported_embs in [
+        (db_word_embs, exported_word_embs),
+        (db_entity_embs, exported_entity_embs),
+    ]:
+        assert len(db_embs) == len(exported_embs)
+        for db_emb, exported_emb in zip(db_embs, exported_embs):
+            if db_emb is None:
+                assert exported_emb is None
+            else:
+                assert np.array_equal(db_emb, exported_emb)
+    assert np.array_equal(exported_word_embs[0], embs["in"])
+    assert exported_word_embs[1] is None
+    assert np.array_equal(exported_word_embs[2], embs["#WORD/UNK#"])
+    assert exported_entity_embs[1] is None
+
+
+def test_embeddings_cache(tmp_path):
+    """
+    Test the cache of embeddings is bounded and cleared when the database is
+    modified.
+    """
+    db_file = str(tmp_path / "embeddings_database.db")
+    with sqlite3.connect(db_file) as conn:
+        conn.execute("CREATE TABLE entity_embeddings (word TEXT, emb BLOB)")
+        conn.executemany(
+            "INSERT INTO entity_embeddings VALUES (?, ?)",
+            [(word, np.zeros(300, dtype=np.float32).tobytes()) for word in "abc"],
+        )
+    with sqlite3.connect(db_file) as conn:
+        cursor = conn.cursor()
+        rel_utils.get_db_emb(cursor, ["a", "b", "c"], "word", cache_size=2)
+        db_path = cursor.execute("PRAGMA database_list").fetchone()[2]
+        assert list(rel_utils.EMB_CACHE[db_path][1]) == ["b", "c"]
+        conn.execute(
+            "UPDATE entity_embeddings SET emb = ? WHERE word = 'c'",
+            (np.ones(300, dtype=np.float32).tobytes(),),
+        )
+        conn.commit()
+        os.utime(db_file, (0, 0))
+        embs = rel_utils.get_db_emb(cursor, ["c"], "word", cache_size=2)
+        assert np.array_equal(embs[0], np.ones(300, dtype=np.float32))
 
 
 def test_prepare_initial_data():
@@ -49,6 +49,32 @@ def test_most_popular():
     assert candidates == {}
 
 
+def test_most_popular_batch():
+    mylinker = linking.Linker(
+        method="mostpopular",
+        resources_path="resources/",
+        linking_resources=dict(),
+        rel_params=dict(),
+        overwrite_training=False,
+    )
+
+    mylinker.load_resources()
+
+    dict_mentions = [
+        {"candidates": {"London": {"Candidates": {"Q84": 0.9, "Q92561": 0.1}}}},
+        {"candidates": {}},
+        {"candidates": {"London": {"Candidates": {"Q92561": 0.1}}}},
+    ]
+    results = mylinker.run_batch(dict_mentions)
+    assert len(results) == 3
+    for dict_mention, result in zip(dict_mentions, results):
+        assert result == mylinker.most_popular(dict_mention)
+    assert results[0].prediction == "Q84"
+    assert results[1] == ("NIL", 0.0, {})
+    assert results[2].prediction == "Q92561"
+    assert results[2].candidates == {"Q92561": 1.0}
+
+
 def test_by_distance():
     mylinker = linking.Linker(
         method="bydistance",
@@ -90,3 +116,41 @@ def test_by_distance():
     assert pred == "NIL"
     assert final_score == 0.0
     assert "Q84" not in resulting_cands
+
+
+def test_by_distance_batch():
+    mylinker = linking.Linker(
+        method="bydistance",
+        resources_path="resources/",
+        linking_resources=dict(),
+        rel_params=dict(),
+        overwrite_training=False,
+    )
+
+    mylinker.load_resources()
+
+    london_cands = {
+        "London": {"Candidates": {"Q84": 0.9, "Q92561": 0.1}, "Score": 0.397048}
+    }
+    dict_mentions = [
+        {"candidates": london_cands, "place_wqid": "Q84"},
+        {"candidates": london_cands, "place_wqid": "Q172"},
+        {"candidates": {}, "place_wqid": "Q172"},
+    ]
+    results = mylinker.run_batch(dict_mentions)
+    assert len(results) == 3
+    for dict_mention, result in zip(dict_mentions, results):
+        assert result == mylinker.by_distance(dict_mention)
+    assert results[0][0] == "Q84"
+    assert results[1][0] == "Q92561"
+    assert results[2] == ("NIL", 0.0, {})
+
+
+def test_haversine_distances():
+    london = [51.5072, -0.1275]
+    coords = np.array([[51.5072, -0.1275], [48.8567, 2.3522], [-33.8678, 151.21]])
+    distances = linking.haversine_distances(london, coords)
+    assert distances.shape == (3,)
+    assert distances[0] == 0.0
+    assert 340 < distances[1] < 345
+    assert 16990 < distances[2] < 17000
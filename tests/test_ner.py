@@ -102,6 +102,41 @@ def test_ner_predict():
     assert preds[6]["word"] == ","
 
 
+def test_ner_predict_batch():
+    myner = recogniser.Recogniser(
+        model="Livingwithmachines/toponym-19thC-en",
+        load_from_hub=True,
+    )
+    myner.pipe = myner.create_pipeline()
+
+    sentences = [
+        "I grew up in Bologna, a city near Florence, but way more interesting.",
+        "",
+        "- I grew up in Plymouth—Kingston.",
+    ]
+    batch_preds = myner.ner_predict_batch(sentences, batch_size=2)
+    assert len(batch_preds) == len(sentences)
+    assert batch_preds[1] == []
+    for sentence, preds in zip(sentences, batch_preds):
+        single_preds = myner.ner_predict(sentence)
+        assert [(p["word"], p["entity"]) for p in preds] == [
+            (p["word"], p["entity"]) for p in single_preds
+        ]
+        for p, sp in zip(preds, single_preds):
+            assert abs(p["score"] - sp["score"]) < 1e-4
+
+    # Post-processing in worker processes, which are stopped on exit:
+    with recogniser.Recogniser(
+        model="Livingwithmachines/toponym-19thC-en",
+        load_from_hub=True,
+        postprocess_workers=2,
+    ) as myner_workers:
+        myner_workers.pipe = myner.pipe
+        assert myner_workers.ner_predict_batch(sentences, batch_size=2) == batch_preds
+        assert myner_workers.postprocess_pool is not None
+    assert myner_workers.postprocess_pool is None
+
+
 def test_ner_load_from_hub():
     myner = recogniser.Recogniser(
         model="Livingwithmachines/toponym-19thC-en",
@@ -188,3 +223,40 @@ def test_aggregate_mentions():
             mentions[i]["mention"]
         )
         assert mentions[i]["mention"] in sentence
+
+
+def test_fix_labels():
+    def token(entity, word, start):
+        return {
+            "entity": entity,
+            "score": 0.9,
+            "word": word,
+            "start": start,
+            "end": start + len(word),
+        }
+
+    # "Ashton-under-Lyne, Island of Terceira":
+    predictions = [
+        token("I-LOC", "Ashton", 0),
+        token("B-LOC", "-", 6),
+        token("B-LOC", "under", 7),
+        token("B-LOC", "-", 12),
+        token("B-LOC", "Lyne", 13),
+        token("O", ",", 17),
+        token("B-LOC", "Island", 19),
+        token("I-LOC", "of", 26),
+        token("B-LOC", "Terceira", 29),
+    ]
+    fixed = ner.fix_labels(predictions)
+    assert [p["entity"] for p in fixed] == [
+        "B-LOC",
+        "I-LOC",
+        "I-LOC",
+        "I-LOC",
+        "I-LOC",
+        "O",
+        "B-LOC",
+        "I-LOC",
+        "I-LOC",
+    ]
+    assert fixed == ner.fix_startEntity(ner.fix_nested(ner.fix_hyphens(predictions)))
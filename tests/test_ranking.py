@@ -307,6 +307,32 @@ def test_find_candidates():
     assert "Q42448" in candidates["Sheftield"]["Sheffield"]["Candidates"]
 
 
+def test_find_candidates_batch():
+    myranker = ranking.Ranker(
+        method="perfectmatch",
+        resources_path="resources/wikidata/",
+        mentions_to_wikidata=dict(),
+        wikidata_to_mentions=dict(),
+    )
+    myranker.mentions_to_wikidata = myranker.load_resources()
+
+    # Test that candidates are split back per list of mentions:
+    wk_cands_lists, already_collected_cands = myranker.find_candidates_batch(
+        [
+            [{"mention": "London"}, {"mention": "Sheffield"}],
+            [],
+            [{"mention": "London"}],
+        ]
+    )
+    assert len(wk_cands_lists) == 3
+    assert list(wk_cands_lists[0].keys()) == ["London", "Sheffield"]
+    assert wk_cands_lists[1] == {}
+    assert list(wk_cands_lists[2].keys()) == ["London"]
+    assert wk_cands_lists[2]["London"] == wk_cands_lists[0]["London"]
+    assert "Q84" in wk_cands_lists[0]["London"]["London"]["Candidates"]
+    assert "London" in already_collected_cands
+
+
 def test_deezy_candidate_ranker():
     deezy_parameters = {
         # Paths and filenames of DeezyMatch models and data:
@@ -35,3 +35,14 @@ def test_wikidata2wikipedia():
     assert (
         process_wikipedia.title_to_id(prepare_url, lower=True, path_to_db=db) == "Q60"
     )
+
+
+def test_titles_to_ids():
+    db = "resources/wikipedia/index_enwiki-latest.db"
+    titles = ["bologna", "BOLOGNA", "new_york_city", "bologna"]
+    mapping = process_wikipedia.titles_to_ids(titles, lower=True, path_to_db=db)
+    assert mapping == {"bologna": "Q1891", "BOLOGNA": None, "new_york_city": "Q60"}
+    for title in mapping:
+        assert mapping[title] == process_wikipedia.title_to_id(
+            title, lower=True, path_to_db=db
+        )
@@ -14,7 +14,8 @@ import torch.optim as optim
 from sklearn.linear_model import LogisticRegression
 from torch.autograd import Variable
 
-sys.path.insert(0, os.path.abspath(os.path.pardir))
+if os.path.abspath(os.path.pardir) not in sys.path:
+    sys.path.insert(0, os.path.abspath(os.path.pardir))
 import utils.REL.utils as utils
 from utils import rel_utils
 from utils.REL.mulrel_ranker import MulRelRanker, PreRank
@@ -493,10 +494,15 @@ class EntityDisambiguation:
             confidence_scores = [0.0 for _ in scores]
         return confidence_scores
 
+    @torch.no_grad()
     def __predict(self, data, include_timing=False, eval_raw=False):
         """
         Uses the trained model to make predictions of individual batches (i.e. documents).
 
+        Predictions are made with gradient tracking disabled, since no
+        backward pass follows, so the forward pass does not record the
+        autograd graph.
+
         Returns: Predictions and time taken for the ED step
         """
         predictions = {items[0]["doc_name"]: [] for items in data}
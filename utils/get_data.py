@@ -1,8 +1,40 @@
 import os
+import shutil
+import urllib.request
 import zipfile
 from pathlib import Path
 
-import wget
+# Size of the chunks in which downloaded files are written to disk:
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+# Timeout (in seconds) of the blocking operations of a download:
+DOWNLOAD_TIMEOUT = 60
+
+
+def download_file(url: str, file_path: str) -> str:
+    """
+    Download a file, streaming it to disk in chunks of
+    ``DOWNLOAD_CHUNK_SIZE`` bytes.
+
+    Arguments:
+        url (str): The URL of the file to download.
+        file_path (str): The path where the file will be stored.
+
+    Returns:
+        str: The path where the file has been stored.
+
+    Note:
+        The file is downloaded to a ``.part`` file, which is only renamed to
+        ``file_path`` once the download is complete, so an interrupted
+        download never leaves a truncated file behind.
+    """
+    part_path = file_path + ".part"
+    with urllib.request.urlopen(url, timeout=DOWNLOAD_TIMEOUT) as response, open(
+        part_path, "wb"
+    ) as f:
+        shutil.copyfileobj(response, f, length=DOWNLOAD_CHUNK_SIZE)
+    os.replace(part_path, file_path)
+    return file_path
 
 
 def download_lwm_data(news_path: str) -> None:
@@ -26,7 +58,7 @@ def download_lwm_data(news_path: str) -> None:
         ).exists()
     ):
         Path(os.path.join(news_path)).mkdir(parents=True, exist_ok=True)
-        lwm_dataset = wget.download(url, out=news_path)
+        lwm_dataset = download_file(url, os.path.join(news_path, "topRes19th_v2.zip"))
         with zipfile.ZipFile(lwm_dataset) as zip_ref:
             zip_ref.extractall(news_path)
 
@@ -48,5 +80,5 @@ def download_hipe_data(hipe_path: str) -> None:
     if not Path(
         os.path.join(f"{hipe_path}", "HIPE-2022-v2.1-hipe2020-dev-en.tsv")
     ).exists():
-        wget.download(dev_url, out=hipe_path, bar=None)
-        wget.download(test_url, out=hipe_path, bar=None)
+        for url in [dev_url, test_url]:
+            download_file(url, os.path.join(hipe_path, os.path.basename(url)))
@@ -3,6 +3,14 @@ from typing import List, Literal, NamedTuple, Tuple, Union
 
 from transformers import PreTrainedTokenizer, PreTrainedTokenizerFast
 
+# Named tuple representing an entity, as returned by collect_named_entities:
+Entity = namedtuple("Entity", "e_type link start_offset end_offset start_char end_char")
+
+# Numbers and punctuation that connect the tokens of a hyphenated entity
+# (numbers and punctuation are common OCR errors), see fix_hyphens:
+NUMBERS = frozenset(str(x) for x in range(0, 10))
+CONNECTORS = frozenset(["-", ",", ".", "’", "'", "?"]) | NUMBERS
+
 
 def training_tokenize_and_align_labels(
     examples: dict,
@@ -12,16 +20,19 @@ def training_tokenize_and_align_labels(
     """
     Tokenize and align labels during training.
 
-    This function takes a training instance, consisting of tokens and named
-    entity recognition (NER) tags, and aligns the tokens with their
-    corresponding labels. It uses a transformers tokenizer object to tokenize
-    the input tokens and then maps the NER tags to label IDs based on the
-    provided label encoding dictionary.
+    This function takes a batch of training instances, each consisting of
+    tokens and named entity recognition (NER) tags, and aligns the tokens
+    with their corresponding labels. It uses a transformers tokenizer object
+    to tokenize the input tokens of the whole batch in a single call, and
+    then maps the NER tags to label IDs based on the provided label encoding
+    dictionary.
 
     Arguments:
-        examples (Dict): A dictionary representing a single training instance
-            with three keys: ``id`` (instance ID), ``tokens`` (list of tokens),
-            and ``ner_tags`` (list of NER tags).
+        examples (Dict): A dictionary representing a batch of training
+            instances, as passed by ``datasets.Dataset.map`` with
+            ``batched=True``, with three keys: ``id`` (list of instance IDs),
+            ``tokens`` (list of lists of tokens), and ``ner_tags`` (list of
+            lists of NER tags).
         tokenizer (Union[PreTrainedTokenizer, PreTrainedTokenizerFast]): A
             transformers tokenizer object, which is the tokenizer of the base
             model.
@@ -33,36 +44,55 @@ def training_tokenize_and_align_labels(
         transformers.tokenization_utils_base.BatchEncoding:
             The tokenized inputs with aligned labels.
 
+    Note:
+        The inputs are not padded here: padding is left to the data collator
+        (``DataCollatorForTokenClassification`` in
+        :py:meth:`~geoparser.recogniser.Recogniser.train`), which pads each
+        training batch to its longest sequence only.
+
     Credit:
         This function is adapted from `HuggingFace <https://github.com/huggingface/transformers/blob/main/examples/pytorch/token-classification/run_ner.py>`_.
     """
     label_all_tokens = True
+    # Encoding of the labels of words, in which the "0" label is always 0:
+    word_label_encoding = {**label_encoding_dict, "0": 0}
     tokenized_inputs = tokenizer(
         list(examples["tokens"]), truncation=True, is_split_into_words=True
     )
     labels = []
     for i, label in enumerate(examples["ner_tags"]):
         word_ids = tokenized_inputs.word_ids(batch_index=i)
-        previous_word_idx = None
-        label_ids = []
-        for word_idx in word_ids:
-            # Special tokens have a word id that is None. We set the label to
-            # -100 so they are automatically ignored in the loss function.
-            if word_idx is None:
-                label_ids.append(-100)
-            elif label[word_idx] == "0":
-                label_ids.append(0)
-            # We set the label for the first token of each word.
-            elif word_idx != previous_word_idx:
-                label_ids.append(label_encoding_dict[label[word_idx]])
-            # For the other tokens in a word, we set the label to either the
-            # current label or -100, depending on the label_all_tokens flag.
-            else:
-                label_ids.append(
-                    label_encoding_dict[label[word_idx]] if label_all_tokens else -100
-                )
-            previous_word_idx = word_idx
-        labels.append(label_ids)
+        # Each word's label is encoded once (words are in order, and only
+        # those kept after truncation are encoded):
+        last_word_idx = next((w for w in reversed(word_ids) if w is not None), -1)
+        word_label_ids = list(
+            map(word_label_encoding.__getitem__, label[: last_word_idx + 1])
+        )
+        # Special tokens have a word id that is None, and their label is set
+        # to -100 so they are automatically ignored in the loss function.
+        if label_all_tokens:
+            # All the tokens of a word have the label of the word:
+            labels.append(
+                [
+                    -100 if word_idx is None else word_label_ids[word_idx]
+                    for word_idx in word_ids
+                ]
+            )
+        else:
+            # Only the first token of each word (i.e. whose word id differs
+            # from that of the previous token) has the label of the word, the
+            # other tokens are set to -100 unless the word's label is "0":
+            labels.append(
+                [
+                    (
+                        -100
+                        if word_idx is None
+                        or (word_idx == previous_word_idx and label[word_idx] != "0")
+                        else word_label_ids[word_idx]
+                    )
+                    for word_idx, previous_word_idx in zip(word_ids, [None] + word_ids)
+                ]
+            )
     tokenized_inputs["labels"] = labels
     return tokenized_inputs
 
@@ -110,14 +140,9 @@ def collect_named_entities(
     ent_type = None
     link = None
 
-    Entity = namedtuple(
-        "Entity", "e_type link start_offset end_offset start_char end_char"
-    )
-    dict_tokens = dict(enumerate(tokens))
-
     for offset, annotation in enumerate(tokens):
         token_tag = annotation[1]
-        token_link = annotation[2]
+        token_type = token_tag[2:]
 
         if token_tag == "O":
             if ent_type is not None and start_offset is not None:
@@ -128,8 +153,8 @@ def collect_named_entities(
                         link,
                         start_offset,
                         end_offset,
-                        dict_tokens[start_offset][3],
-                        dict_tokens[end_offset][4],
+                        tokens[start_offset][3],
+                        tokens[end_offset][4],
                     )
                 )
                 start_offset = None
@@ -138,13 +163,13 @@ def collect_named_entities(
                 link = None
 
         elif ent_type is None:
-            ent_type = token_tag[2:]
-            link = token_link[2:]
+            ent_type = token_type
+            link = annotation[2][2:]
             start_offset = offset
 
-        elif ent_type != token_tag[2:] or (
-            ent_type == token_tag[2:] and token_tag[:1] == "B"
-        ):
+        # A different entity type, or the same type with a "B" prefix,
+        # starts a new entity:
+        elif ent_type != token_type or token_tag[:1] == "B":
             end_offset = offset - 1
             named_entities.append(
                 Entity(
@@ -152,14 +177,14 @@ def collect_named_entities(
                     link,
                     start_offset,
                     end_offset,
-                    dict_tokens[start_offset][3],
-                    dict_tokens[end_offset][4],
+                    tokens[start_offset][3],
+                    tokens[end_offset][4],
                 )
             )
 
             # start of a new entity
-            ent_type = token_tag[2:]
-            link = token_link[2:]
+            ent_type = token_type
+            link = annotation[2][2:]
             start_offset = offset
             end_offset = None
 
@@ -171,8 +196,8 @@ def collect_named_entities(
                 link,
                 start_offset,
                 len(tokens) - 1,
-                dict_tokens[start_offset][3],
-                dict_tokens[len(tokens) - 1][4],
+                tokens[start_offset][3],
+                tokens[len(tokens) - 1][4],
             )
         )
 
@@ -225,39 +250,32 @@ def aggregate_mentions(
 
     sent_mentions = []
     for mention in mentions:
-        # Reconstruct the text of the mention:
-        text_mention = ""
-        mention_token_range = range(mention.start_offset, mention.end_offset + 1)
-        for r in mention_token_range:
-            add_whitespaces = ""
-            # Add white spaces between tokens according to token's char starts
-            # and ends:
-            if r - 1 in mention_token_range:
-                prev_end_char = predictions[r - 1][4]
-                curr_start_char = predictions[r][3]
-                add_whitespaces = (curr_start_char - prev_end_char) * " "
+        start_offset, end_offset = mention.start_offset, mention.end_offset
+        start_token = predictions[start_offset]
+        token_range = range(start_offset, end_offset + 1)
+
+        # Reconstruct the text of the mention, adding white spaces between
+        # tokens according to token's char starts and ends:
+        text_mention = start_token[0]
+        for r in token_range[1:]:
+            add_whitespaces = (predictions[r][3] - predictions[r - 1][4]) * " "
             text_mention += add_whitespaces + predictions[r][0]
 
+        # Consolidate the NER label. The tokens of a mention all have the
+        # same entity type (see collect_named_entities), so it is taken from
+        # the first token:
+        ner_label = start_token[1]
+        if "-" in ner_label:
+            ner_label = ner_label.split("-")[1]
+
         ner_score = 0.0
         entity_link = ""
-        ner_label = ""
-
-        # Consolidate the NER label:
-        ner_label = [
-            predictions[r][1]
-            for r in range(mention.start_offset, mention.end_offset + 1)
-        ]
-        ner_label = list(
-            set([label.split("-")[1] if "-" in label else label for label in ner_label])
-        )[0]
 
         if setting == "pred":
             # Consolidate the NER score
-            ner_score = [
-                predictions[r][-1]
-                for r in range(mention.start_offset, mention.end_offset + 1)
-            ]
-            ner_score = round(sum(ner_score) / len(ner_score), 3)
+            ner_score = round(
+                sum(predictions[r][-1] for r in token_range) / len(token_range), 3
+            )
 
             # Link is at the moment not filled:
             entity_link = "O"
@@ -265,25 +283,16 @@ def aggregate_mentions(
         elif setting == "gold":
             ner_score = 1.0
 
-            # Consolidate the enity link:
-            entity_link = [
-                predictions[r][2]
-                for r in range(mention.start_offset, mention.end_offset + 1)
-            ]
-            entity_link = list(
-                set(
-                    [
-                        label.split("-")[1] if "-" in label else label
-                        for label in entity_link
-                    ]
-                )
-            )[0]
+            # Consolidate the enity link, from the first token of the mention:
+            entity_link = start_token[2]
+            if "-" in entity_link:
+                entity_link = entity_link.split("-")[1]
 
         sent_mentions.append(
             {
                 "mention": text_mention,
-                "start_offset": mention.start_offset,
-                "end_offset": mention.end_offset,
+                "start_offset": start_offset,
+                "end_offset": end_offset,
                 "start_char": mention.start_char,
                 "end_char": mention.end_char,
                 "ner_score": ner_score,
@@ -303,6 +312,7 @@ def aggregate_mentions(
 # * fix_hyphens
 # * fix_nested
 # * fix_startEntity
+# * fix_labels (the three previous fixes in a single pass)
 # * aggregate_entities
 
 
@@ -324,28 +334,19 @@ def fix_capitalization(entity: dict, sentence: str) -> dict:
         dict:
             The corrected entity dictionary with the appropriate
             capitalization.
+
+    Note:
+        The entity dictionary is updated in place and returned, rather than
+        copied into a new dictionary.
     """
 
-    newEntity = entity
+    # To have "word" with the true capitalization, get token from source sentence:
+    word = sentence[entity["start"] : entity["end"]]
     if entity["word"].startswith("##"):
-        newEntity = {
-            "entity": entity["entity"],
-            "score": entity["score"],
-            # To have "word" with the true capitalization, get token from source sentence:
-            "word": "##" + sentence[entity["start"] : entity["end"]],
-            "start": entity["start"],
-            "end": entity["end"],
-        }
-    else:
-        newEntity = {
-            "entity": entity["entity"],
-            "score": entity["score"],
-            # To have "word" with the true capitalization, get token from source sentence:
-            "word": sentence[entity["start"] : entity["end"]],
-            "start": entity["start"],
-            "end": entity["end"],
-        }
-    return newEntity
+        word = "##" + word
+
+    entity["word"] = word
+    return entity
 
 
 def fix_hyphens(lEntities: List[dict]) -> List[dict]:
@@ -380,48 +381,39 @@ def fix_hyphens(lEntities: List[dict]) -> List[dict]:
         same and not ``"O"``, the current entity's prefix is changed to
         ``"I-"`` to maintain the correct grouping.
     """
-    numbers = [str(x) for x in range(0, 10)]
-    connectors = [
-        "-",
-        ",",
-        ".",
-        "’",
-        "'",
-        "?",
-    ] + numbers  # Numbers and punctuation are common OCR errors
-    hyphEntities = []
-    hyphEntities.append(lEntities[0])
+    # Numbers and punctuation are common OCR errors, see CONNECTORS:
+    hyphEntities = [None] * len(lEntities)
+    hyphEntities[0] = lEntities[0]
     for i in range(1, len(lEntities)):
         prevEntity = hyphEntities[i - 1]
         currEntity = lEntities[i]
+        prevType = prevEntity["entity"][2:]
+        currWord = currEntity["word"]
         if (
-            (prevEntity["word"] in connectors or currEntity["word"] in connectors)
+            (prevEntity["word"] in CONNECTORS or currWord in CONNECTORS)
             and (
-                prevEntity["entity"][2:]
-                == currEntity["entity"][2:]  # Either the labels match...
-                or currEntity["word"][
-                    0
-                ].islower()  # ... or the second token is not capitalised...
-                or currEntity["word"]
-                in numbers  # ... or the second token is a number...
-                or prevEntity["end"]
-                == currEntity[
-                    "start"
-                ]  # ... or there's no space between prev and curr tokens
+                # Either the labels match...
+                prevType == currEntity["entity"][2:]
+                # ... or the second token is not capitalised...
+                or currWord[0].islower()
+                # ... or the second token is a number...
+                or currWord in NUMBERS
+                # ... or there's no space between prev and curr tokens
+                or prevEntity["end"] == currEntity["start"]
             )
             and prevEntity["entity"] != "O"
             and currEntity["entity"] != "O"
         ):
             newEntity = {
-                "entity": "I-" + prevEntity["entity"][2:],
+                "entity": "I-" + prevType,
                 "score": currEntity["score"],
                 "word": currEntity["word"],
                 "start": currEntity["start"],
                 "end": currEntity["end"],
             }
-            hyphEntities.append(newEntity)
+            hyphEntities[i] = newEntity
         else:
-            hyphEntities.append(currEntity)
+            hyphEntities[i] = currEntity
 
     return hyphEntities
 
@@ -456,8 +448,8 @@ def fix_nested(lEntities: List[dict]) -> List[dict]:
         the previous and current entity types are not ``"O"``, the current
         entity's prefix is changed to ``"I-"`` to maintain the correct grouping.
     """
-    nestEntities = []
-    nestEntities.append(lEntities[0])
+    nestEntities = [None] * len(lEntities)
+    nestEntities[0] = lEntities[0]
     for i in range(1, len(lEntities)):
         prevEntity = nestEntities[i - 1]
         currEntity = lEntities[i]
@@ -473,9 +465,9 @@ def fix_nested(lEntities: List[dict]) -> List[dict]:
                 "start": currEntity["start"],
                 "end": currEntity["end"],
             }
-            nestEntities.append(newEntity)
+            nestEntities[i] = newEntity
         else:
-            nestEntities.append(currEntity)
+            nestEntities[i] = currEntity
 
     return nestEntities
 
@@ -503,22 +495,20 @@ def fix_startEntity(lEntities: List[dict]) -> List[dict]:
             A list of dictionaries with corrected predictions regarding the
             grouping of labels.
     """
-    fixEntities = []
+    fixEntities = [None] * len(lEntities)
 
     # Case 1: If necessary, fix first entity
     currEntity = lEntities[0]
     if currEntity["entity"].startswith("I-"):
-        fixEntities.append(
-            {
-                "entity": "B-" + currEntity["entity"][2:],
-                "score": currEntity["score"],
-                "word": currEntity["word"],
-                "start": currEntity["start"],
-                "end": currEntity["end"],
-            }
-        )
+        fixEntities[0] = {
+            "entity": "B-" + currEntity["entity"][2:],
+            "score": currEntity["score"],
+            "word": currEntity["word"],
+            "start": currEntity["start"],
+            "end": currEntity["end"],
+        }
     else:
-        fixEntities.append(currEntity)
+        fixEntities[0] = currEntity
 
     # Fix subsequent entities:
     for i in range(1, len(lEntities)):
@@ -536,9 +526,93 @@ def fix_startEntity(lEntities: List[dict]) -> List[dict]:
                 "start": currEntity["start"],
                 "end": currEntity["end"],
             }
-            fixEntities.append(newEntity)
+            fixEntities[i] = newEntity
         else:
-            fixEntities.append(currEntity)
+            fixEntities[i] = currEntity
+
+    return fixEntities
+
+
+def fix_labels(lEntities: List[dict]) -> List[dict]:
+    """
+    Fix prefix assignment errors in hyphenated entities, nested entities and
+    at the start of entities, in a single pass.
+
+    This function returns the same predictions as applying
+    :py:func:`~utils.ner.fix_hyphens`, :py:func:`~utils.ner.fix_nested` and
+    :py:func:`~utils.ner.fix_startEntity` one after the other, but walks the
+    list of tokens only once. Each fix only depends on the label the same
+    fix assigned to the previous token, so the label produced by each of
+    them for the previous token is kept while walking the list.
+
+    Arguments:
+        lEntities (list): A list of dictionaries corresponding to predicted
+            tokens.
+
+    Returns:
+        list:
+            A list of dictionaries with corrected predictions regarding
+            hyphenation, nested entities and the grouping of labels. Tokens
+            whose label does not change are kept as they are.
+    """
+    fixEntities = [None] * len(lEntities)
+    prevEntity = None
+    prevHyphLabel = prevNestLabel = prevFixLabel = None
+    # Per-token flags, computed once for each token and carried over to the
+    # next iteration, where they describe the previous token:
+    prevIsConnector = prevIsOf = False
+    for i, currEntity in enumerate(lEntities):
+        currLabel = currEntity["entity"]
+        currWord = currEntity["word"]
+        currIsConnector = currWord in CONNECTORS
+
+        # Fix hyphens (see fix_hyphens):
+        hyphLabel = currLabel
+        if (
+            prevEntity is not None
+            and (prevIsConnector or currIsConnector)
+            and prevHyphLabel != "O"
+            and currLabel != "O"
+            and (
+                prevHyphLabel[2:] == currLabel[2:]
+                or currWord[0].islower()
+                or currWord in NUMBERS
+                or prevEntity["end"] == currEntity["start"]
+            )
+        ):
+            hyphLabel = "I-" + prevHyphLabel[2:]
+
+        # Fix nested entities (see fix_nested):
+        nestLabel = hyphLabel
+        if prevIsOf and prevNestLabel != "O" and hyphLabel != "O":
+            nestLabel = "I-" + prevNestLabel[2:]
+
+        # Fix the start of entities (see fix_startEntity):
+        fixLabel = nestLabel
+        if nestLabel.startswith("I-") and (
+            prevEntity is None
+            or prevFixLabel == "O"
+            or prevFixLabel[2:] != nestLabel[2:]
+        ):
+            fixLabel = "B-" + nestLabel[2:]
+
+        if fixLabel == currLabel:
+            fixEntities[i] = currEntity
+        else:
+            fixEntities[i] = {
+                "entity": fixLabel,
+                "score": currEntity["score"],
+                "word": currWord,
+                "start": currEntity["start"],
+                "end": currEntity["end"],
+            }
+
+        prevEntity = currEntity
+        prevIsConnector = currIsConnector
+        prevIsOf = currWord.lower() == "of"
+        prevHyphLabel = hyphLabel
+        prevNestLabel = nestLabel
+        prevFixLabel = fixLabel
 
     return fixEntities
 
@@ -561,23 +635,22 @@ def aggregate_entities(entity: dict, lEntities: List[dict]) -> List[dict]:
         list:
             A list of dictionaries with the corrected predictions regarding
             split tokens.
-    """
-    newEntity = entity
 
+    Note:
+        A suffix is joined by updating the previous detected entity in
+        place, rather than by replacing it with a new dictionary.
+    """
     # We remove the word index because we're altering it (by joining suffixes)
-    newEntity.pop("index", None)
+    entity.pop("index", None)
 
     # If word starts with ##, then this is a suffix, join with previous
     # detected entity
-    if entity["word"].startswith("##"):
-        prevEntity = lEntities.pop()
-        newEntity = {
-            "entity": prevEntity["entity"],
-            "score": ((prevEntity["score"] + entity["score"]) / 2.0),
-            "word": prevEntity["word"] + entity["word"].replace("##", ""),
-            "start": prevEntity["start"],
-            "end": entity["end"],
-        }
+    if entity["word"].startswith("##") and lEntities:
+        prevEntity = lEntities[-1]
+        prevEntity["score"] = (prevEntity["score"] + entity["score"]) / 2.0
+        prevEntity["word"] += entity["word"][2:]
+        prevEntity["end"] = entity["end"]
+    else:
+        lEntities.append(entity)
 
-    lEntities.append(newEntity)
     return lEntities
@@ -3,6 +3,7 @@ This script reads the original data sources and formats them for our
 experiments.
 """
 
+import functools
 import glob
 import os
 import re
@@ -12,13 +13,15 @@ from typing import List, Optional, Tuple
 import pandas as pd
 
 # Add "../" to path to import utils
-sys.path.insert(0, os.path.abspath(os.path.pardir))
+if os.path.abspath(os.path.pardir) not in sys.path:
+    sys.path.insert(0, os.path.abspath(os.path.pardir))
 from utils import process_wikipedia
 
 # Path to Wikipedia resources (where the wiki2wiki mapper is located):
 path_to_wikipedia = "../resources/wikipedia/"
 
 
+@functools.lru_cache(maxsize=None)
 def turn_wikipedia2wikidata(wikipedia_title: str) -> Optional[str]:
     """
     Convert a Wikipedia title to its corresponding Wikidata ID.
@@ -37,6 +40,12 @@ def turn_wikipedia2wikidata(wikipedia_title: str) -> Optional[str]:
         'Q11768'
         >>> turn_wikipedia2wikidata("https://en.wikipedia.org/wiki/Invalid_Location")
         Warning: invalid_location is not in wikipedia2wikidata, the wkdt_qid will be None.
+
+    Note:
+        Results are memoized by Wikipedia URL: the same entity is typically
+        linked from many annotated mentions, and each lookup otherwise opens
+        a new connection to the wikipedia2wikidata database. The warning for
+        an unmapped title is therefore only printed the first time.
     """
     if not wikipedia_title == "NIL" and not wikipedia_title == "*":
         wikipedia_title = wikipedia_title.split("/wiki/")[-1]
@@ -286,6 +295,7 @@ def process_lwm_for_linking(
             "publication_code",
         ]
     )
+    rows = []
 
     metadata_df = pd.read_csv(
         os.path.join(f"{tsv_topres_path}", "metadata.tsv"), sep="\t", index_col="fname"
@@ -376,11 +386,12 @@ def process_lwm_for_linking(
             publication_code,
         ]
 
-        # Convert the row into a pd.Series:
-        row = pd.Series(df_columns_row, index=df.columns)
+        # Keep the row, the dataframe is built once all rows are collected:
+        rows.append(df_columns_row)
 
-        # And append it to the main dataframe:
-        df = pd.concat([df, row.to_frame().T], ignore_index=True)
+    # Build the main dataframe at once, instead of concatenating each row
+    # to it (which copies the whole dataframe for every new row):
+    df = pd.DataFrame(rows, columns=df.columns, dtype=object)
 
     return df
 
@@ -508,6 +519,7 @@ def process_hipe_for_linking(hipe_path: str, gazetteer_ids: List[str]) -> pd.Dat
             "publication_code",
         ]
     )
+    rows = []
 
     article_id = ""
     new_sentence = ""
@@ -698,11 +710,12 @@ def process_hipe_for_linking(hipe_path: str, gazetteer_ids: List[str]) -> pd.Dat
             dMetadata[k]["newspaper_id"],  # publication_code
         ]
 
-        # Convert the row into a pd.Series:
-        row = pd.Series(df_columns_row, index=df.columns)
+        # Keep the row, the dataframe is built once all rows are collected:
+        rows.append(df_columns_row)
 
-        # And append it to the main dataframe:
-        df = pd.concat([df, row.to_frame().T], ignore_index=True)
+    # Build the main dataframe at once, instead of concatenating each row
+    # to it (which copies the whole dataframe for every new row):
+    df = pd.DataFrame(rows, columns=df.columns, dtype=object)
 
     return df
 
@@ -741,10 +754,10 @@ def process_tsv(filepath: str) -> Tuple[dict, dict]:
         lines = fr.readlines()
 
     # This regex identifies a token-line in the WebAnno 3.0 format:
-    regex_annline = r"^[0-9]+\-[0-9]+\t[0-9]+\-[0-9]+\t.*$"
+    regex_annline = re.compile(r"^[0-9]+\-[0-9]+\t[0-9]+\-[0-9]+\t.*$")
 
     # This regex identifies annotations that span multiple tokens:
-    regex_multmention = r"^(.*)\[([0-9]+)\]"
+    regex_multmention = re.compile(r"^(.*)\[([0-9]+)\]")
 
     multiple_mention = 0
     prev_multmention = 0
@@ -768,13 +781,16 @@ def process_tsv(filepath: str) -> Tuple[dict, dict]:
     # Loop over all lines in the file:
     for line in lines:
         # If the line is a token-line:
-        if re.match(regex_annline, line):
+        if regex_annline.match(line):
             bio_label = "O"
 
+            # Split the token-line once into its different layers:
+            layers = line.strip().split("\t")
+
             # If the token-line has no annotations, automatically provide
             # them empty annotations:
-            if len(line.strip().split("\t")) == 3:
-                sent_tmp, tok_tmp, token = line.strip().split("\t")
+            if len(layers) == 3:
+                sent_tmp, tok_tmp, token = layers
                 wkpd = "_"
                 label = "_"
             # Otherwise, split the token-line to its different layers:
@@ -784,13 +800,14 @@ def process_tsv(filepath: str) -> Tuple[dict, dict]:
             # * wkpd is the wikipedia link annotation
             # * label is the toponym class annotation
             else:
-                sent_tmp, tok_tmp, token, wkpd, label = line.strip().split("\t")
+                sent_tmp, tok_tmp, token, wkpd, label = layers
 
             # If the annotation corresponds to a multi-token annotation (i.e.
             # WikipediaID string ends with a number enclosed in square
             # brackets, as in "San[1]" and "Francisco[1]"):
 
-            if re.match(regex_multmention, wkpd):
+            wkpd_multmention = regex_multmention.match(wkpd)
+            if wkpd_multmention:
                 # This code basically collates multi-token mentions in
                 # annotations together. "complete_token" is the resulting
                 # multi-token mention, "sent_pos" is the sentence position in
@@ -799,31 +816,29 @@ def process_tsv(filepath: str) -> Tuple[dict, dict]:
 
                 # character start position in the document, and "tok_end" is
                 # the multi-token character end position in the document.
-                multiple_mention = int(re.match(regex_multmention, wkpd).group(2))
-                complete_label = re.match(regex_multmention, label).group(1)
-                complete_wkpd = re.match(regex_multmention, wkpd).group(1)
+                multiple_mention = int(wkpd_multmention.group(2))
+                complete_label = regex_multmention.match(label).group(1)
+                complete_wkpd = wkpd_multmention.group(1)
 
                 # If we identify that we're dealing with a multi-token mention:
                 if multiple_mention == prev_multmention:
                     # Preappend as many white spaces as the distance between
                     # the end of the previous token and the start of the
                     # current token:
-                    complete_token += " " * (
-                        int(tok_tmp.split("-")[0]) - int(prev_endchar)
-                    )
+                    tok_start, tok_end = tok_tmp.split("-")
+                    complete_token += " " * (int(tok_start) - int(prev_endchar))
                     # Append the current token to the complete token:
                     complete_token += token
                     # The complete_token end character will be considered to
                     # be the end of the latest token in the multi-token:
-                    tok_start, tok_end = tok_tmp.split("-")
-                    mtok_end = tok_tmp.split("-")[1]
+                    mtok_end = tok_end
                     # Here we keep the end position of the previous token:
-                    prev_endchar = int(tok_tmp.split("-")[1])
+                    prev_endchar = int(tok_end)
                     bio_label = "I-" + label
                 else:
                     sent_pos, tok_pos = sent_tmp.split("-")
                     tok_start, tok_end = tok_tmp.split("-")
-                    mtok_start, mtok_end = tok_tmp.split("-")
+                    mtok_start, mtok_end = tok_start, tok_end
                     prev_endchar = int(tok_end)
                     complete_token = token
                     bio_label = "B-" + label
@@ -834,7 +849,7 @@ def process_tsv(filepath: str) -> Tuple[dict, dict]:
             else:
                 sent_pos, tok_pos = sent_tmp.split("-")
                 tok_start, tok_end = tok_tmp.split("-")
-                mtok_start, mtok_end = tok_tmp.split("-")
+                mtok_start, mtok_end = tok_start, tok_end
                 complete_token = token
                 complete_label = label
                 complete_wkpd = wkpd
@@ -848,8 +863,8 @@ def process_tsv(filepath: str) -> Tuple[dict, dict]:
             tok_end = int(tok_end)
             mtok_end = int(mtok_end)
 
-            bio_label = bio_label.split("[")[0]
-            wkpd = wkpd.split("[")[0]
+            bio_label = bio_label.partition("[")[0]
+            wkpd = wkpd.partition("[")[0]
 
             dMTokens[(sent_pos, mtok_start)] = (
                 complete_token,
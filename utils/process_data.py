@@ -8,7 +8,8 @@ from typing import TYPE_CHECKING, Any, List, Optional, Tuple
 import pandas as pd
 from tqdm import tqdm
 
-sys.path.insert(0, os.path.abspath(os.path.pardir))
+if os.path.abspath(os.path.pardir) not in sys.path:
+    sys.path.insert(0, os.path.abspath(os.path.pardir))
 from utils import ner
 
 if TYPE_CHECKING:
@@ -73,10 +74,18 @@ def prepare_sents(df: pd.DataFrame) -> Tuple[dict, dict, dict]:
     dSentences = dict()
     dAnnotated = dict()
     dMetadata = dict()
-    for _, row in df.iterrows():
+    # Iterate over the rows as plain dictionaries, which is much cheaper
+    # than building a Series per row with iterrows:
+    for row in df.to_dict("records"):
         sentences = eval_with_exception(row["sentences"], [])
         annotations = eval_with_exception(row["annotations"], [])
 
+        # Group the annotations of the article by sentence once, instead of
+        # scanning all of them for each sentence:
+        sentence_annotations = dict()
+        for a in annotations:
+            sentence_annotations.setdefault(a["sent_pos"], []).append(a)
+
         for s in sentences:
             # Sentence position:
             s_pos = s["sentence_pos"]
@@ -85,24 +94,23 @@ def prepare_sents(df: pd.DataFrame) -> Tuple[dict, dict, dict]:
             # Sentence text:
             dSentences[artsent_id] = s["sentence_text"]
             # Annotations in NER-required format:
-            for a in annotations:
-                if a["sent_pos"] == s_pos:
-                    position = (int(a["mention_start"]), int(a["mention_end"]))
-                    wqlink = a["wkdt_qid"]
-                    if not isinstance(wqlink, str):
-                        wqlink = "NIL"
-                    elif wqlink == "*":
-                        wqlink = "NIL"
-                    if artsent_id in dAnnotated:
-                        dAnnotated[artsent_id][position] = (
-                            a["entity_type"],
-                            a["mention"],
-                            wqlink,
-                        )
-                    else:
-                        dAnnotated[artsent_id] = {
-                            position: (a["entity_type"], a["mention"], wqlink)
-                        }
+            for a in sentence_annotations.get(s_pos, []):
+                position = (int(a["mention_start"]), int(a["mention_end"]))
+                wqlink = a["wkdt_qid"]
+                if not isinstance(wqlink, str):
+                    wqlink = "NIL"
+                elif wqlink == "*":
+                    wqlink = "NIL"
+                if artsent_id in dAnnotated:
+                    dAnnotated[artsent_id][position] = (
+                        a["entity_type"],
+                        a["mention"],
+                        wqlink,
+                    )
+                else:
+                    dAnnotated[artsent_id] = {
+                        position: (a["entity_type"], a["mention"], wqlink)
+                    }
 
             # Keep metadata:
             dMetadata[artsent_id] = dict()
@@ -256,7 +264,7 @@ def postprocess_predictions(
 
 # TODO/typing: set ``myner: recogniser.Recogniser`` here, but creates problem with Sphinx currently
 def ner_and_process(
-    dSentences: dict, dAnnotated: dict, myner
+    dSentences: dict, dAnnotated: dict, myner, batch_size: Optional[int] = 32
 ) -> Tuple[dict, dict, dict, dict, dict]:
     """
     Perform named entity recognition in the LwM way, and postprocess the
@@ -274,6 +282,10 @@ def ner_and_process(
             of named entity (such as ``LOC`` or ``BUILDING``, the mention, and
             its annotated link), all extracted from the gold standard.
         myner (recogniser.Recogniser): a Recogniser object, for NER.
+        batch_size (int, optional): the number of sentences passed through
+            the NER model at once (see
+            :py:meth:`geoparser.recogniser.Recogniser.ner_predict_batch`).
+            Defaults to ``32``.
 
     Returns:
         Tuple[dict, dict, dict, dict, dict]:
@@ -369,22 +381,28 @@ def ner_and_process(
     dSkys = dict()
     dMentionsPred = dict()  # Dictionary of detected mentions
     dMentionsGold = dict()  # Dictionary of gold standard mentions
-    for sent_id in tqdm(list(dSentences.keys())):
-        sent = dSentences[sent_id]
-        annotations = dAnnotated[sent_id]
-        predictions = myner.ner_predict(sent)
-        gold_positions = align_gold(predictions, annotations)
-        sentence_postprocessing = postprocess_predictions(predictions, gold_positions)
-        dPreds[sent_id] = sentence_postprocessing["sentence_preds"]
-        dTrues[sent_id] = sentence_postprocessing["sentence_trues"]
-        dSkys[sent_id] = sentence_postprocessing["sentence_skys"]
-        gold_tokenization[sent_id] = gold_positions
-        dMentionsPred[sent_id] = ner.aggregate_mentions(
-            sentence_postprocessing["sentence_preds"], "pred"
-        )
-        dMentionsGold[sent_id] = ner.aggregate_mentions(
-            sentence_postprocessing["sentence_trues"], "gold"
+    sent_ids = list(dSentences.keys())
+    for batch_start in tqdm(range(0, len(sent_ids), batch_size)):
+        # Run NER on a whole batch of sentences at once:
+        batch_ids = sent_ids[batch_start : batch_start + batch_size]
+        batch_predictions = myner.ner_predict_batch(
+            [dSentences[sent_id] for sent_id in batch_ids], batch_size=batch_size
         )
+        for sent_id, predictions in zip(batch_ids, batch_predictions):
+            gold_positions = align_gold(predictions, dAnnotated[sent_id])
+            sentence_postprocessing = postprocess_predictions(
+                predictions, gold_positions
+            )
+            dPreds[sent_id] = sentence_postprocessing["sentence_preds"]
+            dTrues[sent_id] = sentence_postprocessing["sentence_trues"]
+            dSkys[sent_id] = sentence_postprocessing["sentence_skys"]
+            gold_tokenization[sent_id] = gold_positions
+            dMentionsPred[sent_id] = ner.aggregate_mentions(
+                sentence_postprocessing["sentence_preds"], "pred"
+            )
+            dMentionsGold[sent_id] = ner.aggregate_mentions(
+                sentence_postprocessing["sentence_trues"], "gold"
+            )
 
     return dPreds, dTrues, dSkys, gold_tokenization, dMentionsPred, dMentionsGold
 
@@ -405,13 +423,13 @@ def update_with_linking(ner_predictions: dict, link_predictions: pd.Series) -> d
             Wikidata link for each predicted entity.
     """
     resulting_preds = ner_predictions
-    link_predictions = link_predictions.to_dict(orient="index")
-    for lp in link_predictions:
-        for x in range(
-            link_predictions[lp]["token_start"], link_predictions[lp]["token_end"] + 1
-        ):
+    # Read only the needed columns in a single pass over the rows:
+    for token_start, token_end, pred_wqid in link_predictions[
+        ["token_start", "token_end", "pred_wqid"]
+    ].itertuples(index=False, name=None):
+        for x in range(token_start, token_end + 1):
             position_ner = resulting_preds[x][1][:2]
-            resulting_preds[x][2] = position_ner + link_predictions[lp]["pred_wqid"]
+            resulting_preds[x][2] = position_ner + pred_wqid
     return resulting_preds
 
 
@@ -433,21 +451,19 @@ def update_with_skyline(ner_predictions: dict, link_predictions: pd.Series) -> d
             ranking, otherwise it is set to ``"O"``.
     """
     resulting_preds = ner_predictions
-    link_predictions = link_predictions.to_dict(orient="index")
-    for lp in link_predictions:
-        all_candidates = [
-            list(link_predictions[lp]["candidates"][x]["Candidates"].keys())
-            for x in link_predictions[lp]["candidates"]
-        ]
-        all_candidates = [item for sublist in all_candidates for item in sublist]
-        for x in range(
-            link_predictions[lp]["token_start"], link_predictions[lp]["token_end"] + 1
-        ):
+    # Read only the needed columns in a single pass over the rows:
+    for token_start, token_end, candidates, gold_entity_link in link_predictions[
+        ["token_start", "token_end", "candidates", "gold_entity_link"]
+    ].itertuples(index=False, name=None):
+        all_candidates = {
+            cand
+            for variation in candidates.values()
+            for cand in variation["Candidates"]
+        }
+        for x in range(token_start, token_end + 1):
             position_ner = resulting_preds[x][1][:2]
-            if link_predictions[lp]["gold_entity_link"] in all_candidates:
-                resulting_preds[x][2] = (
-                    position_ner + link_predictions[lp]["gold_entity_link"]
-                )
+            if gold_entity_link in all_candidates:
+                resulting_preds[x][2] = position_ner + gold_entity_link
             else:
                 resulting_preds[x][2] = "O"
     return resulting_preds
@@ -486,6 +502,15 @@ def prepare_storing_links(
         # If we're evaluating entity linking only in the experiment, use
         # mentions from gold standard:
         preds_to_use = "preds"
+
+    # Group the mentions by sentence once, instead of filtering the whole
+    # dataframe for each sentence:
+    test_mentions_by_sentence = {
+        sent_id: sentence_df
+        for sent_id, sentence_df in test_df.groupby("sentence_id", sort=False)
+    }
+    all_test = set(all_test)
+
     for sent_id in processed_data[preds_to_use]:
         article_id = sent_id.split("_")[0]
         # First: sentence should be in the current test set:
@@ -495,7 +520,7 @@ def prepare_storing_links(
             # >> Step 1. If there is no mention in the sentence, it will
             #            not be in the per-mention dataframe. However,
             #            it should still be in the results file.
-            if not sent_id in test_df["sentence_id"].unique():
+            if not sent_id in test_mentions_by_sentence:
                 resulting_preds = [
                     [x[0], x[1], "O", x[3], x[4]] for x in ner_predictions
                 ]
@@ -508,14 +533,14 @@ def prepare_storing_links(
                 ]
                 processed_data["preds"][sent_id] = update_with_linking(
                     resulting_preds,  # NER predictions
-                    test_df[test_df["sentence_id"] == sent_id],  # Processed df
+                    test_mentions_by_sentence[sent_id],  # Processed df
                 )
                 resulting_preds = [
                     [x[0], x[1], "O", x[3], x[4]] for x in ner_predictions
                 ]
                 processed_data["skys"][sent_id] = update_with_skyline(
                     resulting_preds,  # NER predictions
-                    test_df[test_df["sentence_id"] == sent_id],  # Processed df
+                    test_mentions_by_sentence[sent_id],  # Processed df
                 )
     return processed_data
 
@@ -1,8 +1,17 @@
+import functools
 import sqlite3
 import urllib.parse
-from typing import Optional
+from typing import Dict, List, Optional
 
+# SQLite limits the number of host parameters in a single statement (999 in
+# older builds), so batched lookups are split into chunks of this size:
+SQLITE_BATCH_SIZE = 500
 
+# Maximum number of normalised titles memoized by the functions below:
+TITLE_CACHE_SIZE = 1_000_000
+
+
+@functools.lru_cache(maxsize=TITLE_CACHE_SIZE)
 def make_wikilinks_consistent(url: str) -> str:
     """
     Make the wiki links consistent by performing the following operations:
@@ -26,6 +35,10 @@ def make_wikilinks_consistent(url: str) -> str:
         'data%20science'
         >>> make_wikilinks_consistent("San_Francisco")
         'san%20francisco'
+
+    Note:
+        This is a pure function of ``url``, and the same titles recur across
+        documents, so results are memoized (up to ``TITLE_CACHE_SIZE``).
     """
     url = url.lower()
     unquote = urllib.parse.unquote(url)
@@ -37,16 +50,16 @@ def make_wikilinks_consistent(url: str) -> str:
     return quote
 
 
+@functools.lru_cache(maxsize=TITLE_CACHE_SIZE)
 def make_wikipedia2wikidata_consisent(entity: str) -> str:
     """
     Make the Wikipedia entity consistent with Wikidata by performing the
     following operations:
 
-    #. Make the wiki links consistent using the 'make_wikilinks_consistent'
-       function.
-    #. Unquote the modified and quoted URL to decode any percent-encoded
-       characters.
-    #. Replace spaces with underscores in the unquoted URL.
+    #. Convert the entity to lowercase.
+    #. Unquote the entity to decode any percent-encoded characters.
+    #. Remove any fragment identifier (text after the '#' symbol) if present.
+    #. Replace spaces with underscores.
 
     Arguments:
         entity (str): The Wikipedia entity to make consistent.
@@ -60,9 +73,16 @@ def make_wikipedia2wikidata_consisent(entity: str) -> str:
         'new_york_city'
         >>> make_wikipedia2wikidata_consistent("Data science")
         'data_science'
+
+    Note:
+        The result is the same as unquoting the output of
+        :py:func:`make_wikilinks_consistent` and replacing its spaces with
+        underscores.
     """
-    quoted_entity = make_wikilinks_consistent(entity)
-    underscored = urllib.parse.unquote(quoted_entity).replace(" ", "_")
+    unquote = urllib.parse.unquote(entity.lower())
+    if "#" in unquote:
+        unquote = unquote.split("#")[0]
+    underscored = unquote.replace(" ", "_")
     return underscored
 
 
@@ -106,3 +126,51 @@ def title_to_id(
         return result[0]
     else:
         return None
+
+
+def titles_to_ids(
+    page_titles: List[str], path_to_db: str, lower: Optional[bool] = False
+) -> Dict[str, Optional[str]]:
+    """
+    Given a list of Wikipedia page titles, returns the corresponding Wikidata
+    IDs. This is the batched counterpart of :py:func:`title_to_id`: the
+    database is opened once and titles are resolved with one ``IN`` query per
+    chunk of :py:data:`SQLITE_BATCH_SIZE` titles, instead of one query (and
+    one connection) per title.
+
+    Arguments:
+        page_titles (List[str]): The page titles of the Wikipedia entries,
+            in the same format as expected by :py:func:`title_to_id`.
+        path_to_db (str): The path to the wikidata2wikipedia db.
+        lower (bool, optional): Whether to match against the lowercased
+            Wikipedia titles. Defaults to ``False``.
+
+    Returns:
+        Dict[str, Optional[str]]:
+            A dictionary mapping each unique input title to its Wikidata ID,
+            or to None if no mapping could be found.
+
+    Example:
+        >>> titles_to_ids(["bologna", "new_york_city", "BOLOGNA"], path_to_db, lower=True)
+        {'bologna': 'Q1891', 'new_york_city': 'Q60', 'BOLOGNA': None}
+    """
+    column = "lower_wikipedia_title" if lower == True else "wikipedia_title"
+    unique_titles = list(dict.fromkeys(page_titles))
+    mapping = {title: None for title in unique_titles}
+
+    with sqlite3.connect(path_to_db) as conn:
+        c = conn.cursor()
+        for i in range(0, len(unique_titles), SQLITE_BATCH_SIZE):
+            chunk = unique_titles[i : i + SQLITE_BATCH_SIZE]
+            placeholders = ",".join("?" * len(chunk))
+            c.execute(
+                f"SELECT {column}, wikidata_id FROM mapping "
+                f"WHERE {column} IN ({placeholders})",
+                chunk,
+            )
+            for title, wikidata_id in c.fetchall():
+                # Keep the first match, as ``title_to_id`` does with fetchone:
+                if mapping[title] is None and wikidata_id is not None:
+                    mapping[title] = wikidata_id
+
+    return mapping
@@ -1,16 +1,37 @@
 import json
 import os
 import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
 
 import requests
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
 
 # Import utils
-sys.path.insert(0, os.path.abspath(os.path.pardir))
+if os.path.abspath(os.path.pardir) not in sys.path:
+    sys.path.insert(0, os.path.abspath(os.path.pardir))
 from utils import process_data, process_wikipedia
 from experiments import experiment
 
+PATH_TO_WIKI_DB = "../resources/wikipedia/index_enwiki-latest.db"
+REL_API_URL = "https://rel.cs.ru.nl/api"
+MAX_CONCURRENT_REQUESTS = 10
+CHECKPOINT_EVERY = 50
+# Timeout (in seconds) of each request to the REL API:
+REL_API_TIMEOUT = 60
+
+# Shared HTTP session, so that connections to the REL API are pooled and
+# reused across requests instead of being re-established for each sentence:
+_session = requests.Session()
+_session.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=MAX_CONCURRENT_REQUESTS,
+        pool_maxsize=MAX_CONCURRENT_REQUESTS,
+    ),
+)
+
 
 def rel_end_to_end(sent: str) -> dict:
     """
@@ -22,12 +43,18 @@ def rel_end_to_end(sent: str) -> dict:
     Returns:
         dict: The output from the REL end-to-end API for the input sentence.
     """
-    API_URL = "https://rel.cs.ru.nl/api"
-    el_result = requests.post(API_URL, json={"text": sent, "spans": []}).json()
+    el_result = _session.post(
+        REL_API_URL, json={"text": sent, "spans": []}, timeout=REL_API_TIMEOUT
+    ).json()
     return el_result
 
 
-def get_rel_from_api(dSentences: dict, rel_end2end_path: str) -> None:
+def get_rel_from_api(
+    dSentences: dict,
+    rel_end2end_path: str,
+    max_concurrent_requests: int = MAX_CONCURRENT_REQUESTS,
+    checkpoint_every: int = CHECKPOINT_EVERY,
+) -> None:
     """
     Use the REL API to perform end-to-end entity linking.
 
@@ -37,9 +64,24 @@ def get_rel_from_api(dSentences: dict, rel_end2end_path: str) -> None:
             sentence.
         rel_end2end_path (str): The path of the file where the REL results
             will be stored.
+        max_concurrent_requests (int, optional): The maximum number of
+            requests to the REL API that can be in flight at the same time.
+            Defaults to ``10``.
+        checkpoint_every (int, optional): The number of newly processed
+            sentences after which the results are written to disk.
+            Defaults to ``50``.
 
     Returns:
         None.
+
+    Note:
+        The file at ``rel_end2end_path`` acts as a persistent cache: sentences
+        already stored there are not sent to the API again. The file is
+        rewritten atomically every ``checkpoint_every`` sentences and once
+        more at the end (also if the API fails), so that progress is kept in
+        case of API limits. If a request fails, no new request is sent, the
+        results of the requests in flight are kept, and the first error is
+        then raised.
     """
     # Dictionary to store REL predictions:
     rel_preds = dict()
@@ -47,14 +89,65 @@ def get_rel_from_api(dSentences: dict, rel_end2end_path: str) -> None:
         with open(rel_end2end_path) as f:
             rel_preds = json.load(f)
     print("\nObtain REL linking from API (unless already stored):")
-    for s in tqdm(dSentences):
-        if not s in rel_preds:
-            rel_preds[s] = rel_end_to_end(dSentences[s])
-            # Append per processed sentence in case of API limit:
-            with open(rel_end2end_path, "w") as fp:
-                json.dump(rel_preds, fp)
-            with open(rel_end2end_path) as f:
-                rel_preds = json.load(f)
+    to_query = [s for s in dSentences if not s in rel_preds]
+    first_error = None
+    try:
+        with ThreadPoolExecutor(max_workers=max_concurrent_requests) as executor:
+            sentences = iter(to_query)
+            pending = dict()
+            nb_processed = 0
+            with tqdm(total=len(to_query)) as pbar:
+                while True:
+                    # Keep at most max_concurrent_requests requests in flight,
+                    # and stop sending new ones after a request has failed:
+                    while (
+                        first_error is None and len(pending) < max_concurrent_requests
+                    ):
+                        s = next(sentences, None)
+                        if s is None:
+                            break
+                        pending[executor.submit(rel_end_to_end, dSentences[s])] = s
+                    if not pending:
+                        break
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        s = pending.pop(future)
+                        try:
+                            rel_preds[s] = future.result()
+                        except Exception as e:
+                            if first_error is None:
+                                first_error = e
+                            continue
+                        nb_processed += 1
+                        pbar.update()
+                        # Checkpoint periodically in case of API limit:
+                        if nb_processed % checkpoint_every == 0:
+                            store_rel_preds(rel_preds, rel_end2end_path)
+        if first_error is not None:
+            raise first_error
+    finally:
+        if to_query:
+            store_rel_preds(rel_preds, rel_end2end_path)
+
+
+def store_rel_preds(rel_preds: dict, rel_end2end_path: str) -> None:
+    """
+    Write the REL predictions to disk, going through a temporary file so that
+    an interrupted write never leaves a truncated JSON file behind.
+
+    Arguments:
+        rel_preds (dict): A dictionary mapping sentence IDs to REL
+            predictions.
+        rel_end2end_path (str): The path of the file where the REL results
+            will be stored.
+
+    Returns:
+        None.
+    """
+    tmp_path = rel_end2end_path + ".tmp"
+    with open(tmp_path, "w") as fp:
+        json.dump(rel_preds, fp)
+    os.replace(tmp_path, rel_end2end_path)
 
 
 def match_wikipedia_to_wikidata(wiki_title: str) -> str:
@@ -72,14 +165,14 @@ def match_wikipedia_to_wikidata(wiki_title: str) -> str:
     wqid = process_wikipedia.title_to_id(
         wiki_title,
         lower=False,
-        path_to_db="../resources/wikipedia/index_enwiki-latest.db",
+        path_to_db=PATH_TO_WIKI_DB,
     )
     if not wqid:
         wqid = "NIL"
     return wqid
 
 
-def match_ent(pred_ents, start, end, prev_ann, gazetteer_ids):
+def match_ent(pred_ents, start, end, prev_ann, gazetteer_ids, wiki2wqid=None):
     """
     Find the corresponding string and prediction information returned by REL
     for a specific gold standard token position in a sentence.
@@ -92,6 +185,10 @@ def match_ent(pred_ents, start, end, prev_ann, gazetteer_ids):
         end (int): The end character offset of the token in the gold standard.
         prev_ann (str): The entity type of the previous token.
         gazetteer_ids (set): A set of entity IDs in the knowledge base.
+        wiki2wqid (dict, optional): A dictionary mapping Wikipedia titles to
+            Wikidata IDs, as returned by
+            :py:func:`utils.process_wikipedia.titles_to_ids`. If not
+            provided, titles are looked up one by one in the database.
 
     Returns:
         tuple: A tuple with three elements:
@@ -100,7 +197,10 @@ def match_ent(pred_ents, start, end, prev_ann, gazetteer_ids):
             #. The entity type of the previous token.
     """
     for ent in pred_ents:
-        wqid = match_wikipedia_to_wikidata(ent[3])
+        if wiki2wqid is not None:
+            wqid = wiki2wqid.get(ent[3]) or "NIL"
+        else:
+            wqid = match_wikipedia_to_wikidata(ent[3])
         # If entity is a LOC or linked entity is in our KB:
         if ent[-1] == "LOC" or wqid in gazetteer_ids:
             # Any place with coordinates is considered a location
@@ -117,7 +217,7 @@ def match_ent(pred_ents, start, end, prev_ann, gazetteer_ids):
 
                 n = ent_pos + ent_type
                 try:
-                    el = ent_pos + match_wikipedia_to_wikidata(ent[3])
+                    el = ent_pos + wqid
                 except Exception as e:
                     print(e)
                     # to be checked but it seems some Wikipedia pages are not in our Wikidata
@@ -145,17 +245,30 @@ def postprocess_rel(rel_preds, dSentences, gold_tokenization, wikigaz_ids):
             A dictionary that maps a sentence ID to the REL predictions,
             retokenized as in the gold standard.
     """
+    # Resolve all predicted Wikipedia titles in one batched database lookup:
+    wiki_titles = [ent[3] for preds in rel_preds.values() for ent in preds]
+    wiki2wqid = process_wikipedia.titles_to_ids(
+        wiki_titles, path_to_db=PATH_TO_WIKI_DB, lower=False
+    )
+
     dREL = dict()
     for sent_id in tqdm(list(dSentences.keys())):
+        # Keep only the predictions of the sentence that can be matched to a
+        # token (i.e. locations or entities in the gazetteer), resolving each
+        # of them once per sentence rather than once per token:
+        current_preds = [
+            ent
+            for ent in rel_preds.get(sent_id, [])
+            if ent[-1] == "LOC" or (wiki2wqid.get(ent[3]) or "NIL") in wikigaz_ids
+        ]
         sentence_preds = []
         prev_ann = ""
         for token in gold_tokenization[sent_id]:
             start = token["start"]
             end = token["end"]
             word = token["word"]
-            current_preds = rel_preds.get(sent_id, [])
             n, el, prev_ann = match_ent(
-                current_preds, start, end, prev_ann, wikigaz_ids
+                current_preds, start, end, prev_ann, wikigaz_ids, wiki2wqid
             )
             sentence_preds.append([word, n, el])
         dREL[sent_id] = sentence_preds
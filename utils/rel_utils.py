@@ -1,15 +1,18 @@
-import json
 import os
+import pickle
 import sqlite3
 import sys
-from array import array
 from ast import literal_eval
-from typing import Any, List, Literal, Optional
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, List, Literal, Optional, Tuple
 
 import numpy as np
+import orjson
 import pandas as pd
 
-sys.path.insert(0, os.path.abspath(os.path.pardir))
+if os.path.abspath(os.path.pardir) not in sys.path:
+    sys.path.insert(0, os.path.abspath(os.path.pardir))
 from geoparser import ranking
 
 RANDOM_SEED = 42
@@ -28,11 +31,288 @@ desired.
 """
 np.random.seed(RANDOM_SEED)
 
+# SQLite limits the number of host parameters in a single statement (999 in
+# older builds), so batched lookups are split into chunks of this size:
+SQLITE_BATCH_SIZE = 500
+
+# Default maximum number of embeddings kept in memory by get_db_emb for each
+# database file (about 24MB of 300-dimensional embeddings), with the
+# embeddings retrieved first being evicted first:
+EMB_CACHE_SIZE = 20_000
+
+# Embeddings (or None, if not found) already retrieved by get_db_emb, mapping
+# the path of each database file to a tuple of the modification time of the
+# file and an ordered dictionary of embeddings by word:
+EMB_CACHE = dict()
+
+# Embeddings exported from each database file by export_db_emb, as a tuple of
+# the row of each word and the memory-mapped matrix of embeddings (or None, if
+# there is no up-to-date export of the database file):
+EMB_EXPORTS = dict()
+
+
+def db_emb_export_paths(db_file: str) -> Tuple[str, str]:
+    """
+    Get the paths of the files to which the embeddings of a Wikipedia2Vec
+    database are exported by :py:func:`export_db_emb`.
+
+    Arguments:
+        db_file (str): The path to the Wikipedia2Vec database.
+
+    Returns:
+        Tuple[str, str]:
+            The path of the ``.npy`` file with the matrix of embeddings, and
+            the path of the pickle file with the row of each word in the
+            matrix, both next to the database file.
+    """
+    basename = os.path.splitext(db_file)[0]
+    return basename + "_emb.npy", basename + "_emb_words.pkl"
+
+
+def export_db_emb(db_file: str) -> Tuple[str, str]:
+    """
+    Export the embeddings of a Wikipedia2Vec database to a NumPy matrix that
+    :py:func:`get_db_emb` can memory-map, instead of decoding each embedding
+    from the database.
+
+    Arguments:
+        db_file (str): The path to the Wikipedia2Vec database.
+
+    Returns:
+        Tuple[str, str]:
+            The paths of the exported files, as returned by
+            :py:func:`db_emb_export_paths`.
+
+    Note:
+        The export only needs to be run once: it is used by
+        :py:func:`get_db_emb` as long as it is more recent than the database
+        file. Its files take about as much disk space as the database, and
+        the row of each word is loaded into memory on first use. Both files
+        are written to temporary files first, and moved into place at the
+        end (the row of each word last), so an interrupted export never
+        leaves a partial export that would be used.
+
+    Example:
+        >>> rel_utils.export_db_emb("../resources/rel_db/embeddings_database.db")
+        ('../resources/rel_db/embeddings_database_emb.npy', '../resources/rel_db/embeddings_database_emb_words.pkl')
+    """
+    matrix_path, words_path = db_emb_export_paths(db_file)
+    matrix_tmp_path, words_tmp_path = matrix_path + ".tmp", words_path + ".tmp"
+    with sqlite3.connect(db_file) as conn:
+        cursor = conn.cursor()
+        nb_rows = cursor.execute("SELECT COUNT(*) FROM entity_embeddings").fetchone()[0]
+        first_emb = cursor.execute(
+            "SELECT emb FROM entity_embeddings LIMIT 1"
+        ).fetchone()
+        dim = len(first_emb[0]) // np.dtype(np.float32).itemsize if first_emb else 0
+        matrix = np.lib.format.open_memmap(
+            matrix_tmp_path, mode="w+", dtype=np.float32, shape=(nb_rows, dim)
+        )
+        word_rows = dict()
+        for word, emb in cursor.execute("SELECT word, emb FROM entity_embeddings"):
+            # Keep the first match, as a query with fetchone would:
+            if word not in word_rows:
+                matrix[len(word_rows)] = np.frombuffer(emb, dtype=np.float32)
+                word_rows[word] = len(word_rows)
+        matrix.flush()
+        del matrix
+
+    with open(words_tmp_path, "wb") as f:
+        pickle.dump(word_rows, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    # Remove the row of each word of any previous export before replacing its
+    # matrix, so that the new matrix is never used with the previous rows:
+    if os.path.exists(words_path):
+        os.remove(words_path)
+    os.replace(matrix_tmp_path, matrix_path)
+    os.replace(words_tmp_path, words_path)
+
+    # Forget any previous export of the database (indexed by the full path of
+    # the database file, as given by SQLite):
+    EMB_EXPORTS.pop(os.path.realpath(db_file), None)
+    EMB_CACHE.pop(os.path.realpath(db_file), None)
+
+    return matrix_path, words_path
+
+
+def load_db_emb_export(db_file: str) -> Optional[Tuple[dict, np.ndarray]]:
+    """
+    Load the embeddings exported from a Wikipedia2Vec database by
+    :py:func:`export_db_emb`, if they are more recent than the database.
+
+    Arguments:
+        db_file (str): The path to the Wikipedia2Vec database.
+
+    Returns:
+        Optional[Tuple[dict, np.ndarray]]:
+            The row of each word, and the read-only memory-mapped matrix of
+            embeddings, or None if there is no up-to-date export. The result
+            is kept in :py:data:`EMB_EXPORTS`, so each export is only loaded
+            once.
+    """
+    if db_file not in EMB_EXPORTS:
+        export = None
+        export_paths = db_emb_export_paths(db_file)
+        if all(
+            os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(db_file)
+            for path in export_paths
+        ):
+            matrix_path, words_path = export_paths
+            with open(words_path, "rb") as f:
+                word_rows = pickle.load(f)
+            export = (word_rows, np.load(matrix_path, mmap_mode="r"))
+        EMB_EXPORTS[db_file] = export
+    return EMB_EXPORTS[db_file]
+
+
+def preprocess_db_emb_keys(
+    mentions: List[str],
+    embtype: Literal["word", "entity", "snd"],
+) -> dict:
+    """
+    Map each unique mention to the key under which its Wikipedia2Vec
+    embedding is stored in the database.
+
+    Arguments:
+        mentions (List[str]): The list of words or entities whose embeddings to
+            extract.
+        embtype (Literal["word", "entity", "snd"]): The type of embedding to
+            retrieve (see :py:func:`get_db_emb`).
+
+    Returns:
+        dict:
+            A dictionary mapping each unique mention (in order of first
+            appearance) to its key in the database, or to ``None`` if no
+            embedding can be found for this type of embedding.
+
+    Note:
+        - If the mention is an entity, the prefix ``ENTITY/`` is preappended to
+          the mention.
+        - If the mention is a word, the string is converted to lowercase, and
+          the unknown ``"snd"`` embedding is mapped to the unknown word
+          embedding.
+        - Each mention is only preprocessed once, as the same words are often
+          repeated.
+    """
+    if embtype == "entity":
+        return {
+            mention: mention if mention == "#ENTITY/UNK#" else "ENTITY/" + mention
+            for mention in dict.fromkeys(mentions)
+        }
+    if embtype == "word" or embtype == "snd":
+        return {
+            mention: (
+                "#WORD/UNK#"
+                if mention == "#WORD/UNK#" or mention == "#SND/UNK#"
+                else mention.lower()
+            )
+            for mention in dict.fromkeys(mentions)
+        }
+    # No embedding is found for other types of embeddings:
+    return dict.fromkeys(mentions)
+
+
+def get_db_emb_by_key(
+    cursor: sqlite3.Cursor,
+    keys: List[Optional[str]],
+    cache_size: Optional[int] = None,
+) -> List[Optional[np.ndarray]]:
+    """
+    Retrieve Wikipedia2Vec embeddings for a given list of database keys.
+
+    Arguments:
+        cursor: The cursor with the open connection to the Wikipedia2Vec
+            database.
+        keys (List[Optional[str]]): The list of keys (as returned by
+            :py:func:`preprocess_db_emb_keys`) whose embeddings to extract.
+        cache_size (int, optional): The maximum number of embeddings kept in
+            memory for the database file. If None, it is set to
+            :py:data:`EMB_CACHE_SIZE`.
+
+    Returns:
+        List[Optional[np.ndarray]]:
+            A list of arrays (or ``None``) representing the embeddings for the
+            given keys. The arrays are read-only and shared with other calls
+            (see below), so they must be copied (e.g. with ``np.array`` or
+            ``torch.tensor``) before being modified.
+
+    Note:
+        - If an embedding is not found for a key (or the key is ``None``), the
+          corresponding element in the returned list is set to None.
+        - The database is queried with one ``IN`` query per chunk of
+          :py:data:`SQLITE_BATCH_SIZE` unique keys, rather than once per key.
+        - If the embeddings of the database have been exported with
+          :py:func:`export_db_emb`, they are read from the memory-mapped
+          export rather than queried from the database.
+        - The arrays are read-only views over the bytes stored in the
+          database (no copy is made), and are shared between calls: the
+          embeddings retrieved from a database file are kept in
+          :py:data:`EMB_CACHE` (up to ``cache_size`` per file), so that each
+          key is only looked up once. The cache of a database file is cleared
+          when the file is modified.
+    """
+    if cache_size is None:
+        cache_size = EMB_CACHE_SIZE
+
+    # Embeddings are cached for each database file, and forgotten (along with
+    # the export of the database) if the file has been modified since they
+    # were retrieved. In-memory databases have no file, so their embeddings are
+    # not cached:
+    db_file = cursor.execute("PRAGMA database_list").fetchone()[2]
+    if db_file:
+        db_mtime = os.path.getmtime(db_file)
+        cache_mtime, cache = EMB_CACHE.get(db_file, (None, None))
+        if cache_mtime != db_mtime:
+            cache = OrderedDict()
+            EMB_CACHE[db_file] = (db_mtime, cache)
+            EMB_EXPORTS.pop(db_file, None)
+    else:
+        cache = OrderedDict()
+
+    # Retrieve the unique keys not in the cache, either from the export of the
+    # database (see export_db_emb) if there is an up-to-date one, or from the
+    # database itself in chunks, with one query per chunk:
+    unique_keys = [
+        key for key in dict.fromkeys(keys) if key is not None and key not in cache
+    ]
+    export = load_db_emb_export(db_file) if db_file else None
+    if export is not None:
+        # Read the embeddings from the memory-mapped export of the database:
+        word_rows, matrix = export
+        for key in unique_keys:
+            row = word_rows.get(key)
+            cache[key] = None if row is None else np.asarray(matrix[row])
+    else:
+        found = dict()
+        for i in range(0, len(unique_keys), SQLITE_BATCH_SIZE):
+            chunk = unique_keys[i : i + SQLITE_BATCH_SIZE]
+            placeholders = ",".join("?" * len(chunk))
+            for word, emb in cursor.execute(
+                "SELECT word, emb FROM entity_embeddings "
+                f"WHERE word IN ({placeholders})",
+                chunk,
+            ).fetchall():
+                # Keep the first match, as a query with fetchone would:
+                found.setdefault(word, emb)
+        for key in unique_keys:
+            emb = found.get(key)
+            cache[key] = emb if emb is None else np.frombuffer(emb, dtype=np.float32)
+
+    # Reassemble the results in the order of the keys:
+    results = [cache.get(key) for key in keys]
+
+    # Evict the oldest embeddings if the cache is full:
+    while len(cache) > cache_size:
+        cache.popitem(last=False)
+
+    return results
+
 
 def get_db_emb(
     cursor: sqlite3.Cursor,
     mentions: List[str],
     embtype: Literal["word", "entity", "snd"],
+    cache_size: Optional[int] = None,
 ) -> List[Optional[np.ndarray]]:
     """
     Retrieve Wikipedia2Vec embeddings for a given list of words or entities.
@@ -47,46 +327,33 @@ def get_db_emb(
             ``"snd"``. If it is set to ``"word"`` or ``"snd"``, we use
             Wikipedia2Vec word embeddings, if it is set to ``"entity"``, we
             use Wikipedia2Vec entity embeddings.
+        cache_size (int, optional): The maximum number of embeddings kept in
+            memory for the database file (see :py:func:`get_db_emb_by_key`).
+            If None, it is set to :py:data:`EMB_CACHE_SIZE`.
 
     Returns:
         List[Optional[np.ndarray]]:
             A list of arrays (or ``None``) representing the embeddings for the
-            given mentions.
+            given mentions. The arrays are read-only and shared with other
+            calls (see :py:func:`get_db_emb_by_key`), so they must be copied
+            (e.g. with ``np.array`` or ``torch.tensor``) before being
+            modified.
 
     Note:
-        - The embeddings are extracted from the Wikipedia2Vec database using
-          the provided cursor.
-        - If the mention is an entity, the prefix ``ENTITY/`` is preappended to
-          the mention before querying the database.
-        - If the mention is a word, the string is converted to lowercase
-          before querying the database.
+        - The mentions are mapped to their keys in the database with
+          :py:func:`preprocess_db_emb_keys`, and the embeddings are then
+          retrieved with :py:func:`get_db_emb_by_key`. Callers that request
+          several times the embeddings of the same mentions can preprocess
+          them once and call :py:func:`get_db_emb_by_key` directly.
         - If an embedding is not found for a mention, the corresponding
           element in the returned list is set to None.
         - Differently from the original REL implementation, we use Wikipedia2vec
           embeddings both for ``"word"`` and ``"snd"``.
     """
-
-    results = []
-    for mention in mentions:
-        result = None
-        # Preprocess the mention depending on which embedding to obtain:
-        if embtype == "entity":
-            if not mention == "#ENTITY/UNK#":
-                mention = "ENTITY/" + mention
-            result = cursor.execute(
-                "SELECT emb FROM entity_embeddings WHERE word=?", (mention,)
-            ).fetchone()
-        if embtype == "word" or embtype == "snd":
-            if mention in ["#WORD/UNK#", "#SND/UNK#"]:
-                mention = "#WORD/UNK#"
-            else:
-                mention = mention.lower()
-            result = cursor.execute(
-                "SELECT emb FROM entity_embeddings WHERE word=?", (mention,)
-            ).fetchone()
-        results.append(result if result is None else array("f", result[0]).tolist())
-
-    return results
+    mention_keys = preprocess_db_emb_keys(mentions, embtype)
+    return get_db_emb_by_key(
+        cursor, [mention_keys[mention] for mention in mentions], cache_size
+    )
 
 
 def eval_with_exception(str2parse: str, in_case: Optional[Any] = "") -> Any:
@@ -109,13 +376,16 @@ def eval_with_exception(str2parse: str, in_case: Optional[Any] = "") -> Any:
         return in_case
 
 
-def prepare_initial_data(df: pd.DataFrame) -> dict:
+def prepare_initial_data(df: pd.DataFrame, workers: Optional[int] = 0) -> dict:
     """
     Generate the initial JSON data needed to train a REL model from a
     DataFrame.
 
     Arguments:
         df: The dataframe containing the linking training data.
+        workers (int, optional): The number of worker processes across which
+            the rows of the dataframe are split. If ``0``, the rows are
+            processed in the main process (default: ``0``).
 
     Returns:
         dict:
@@ -129,28 +399,37 @@ def prepare_initial_data(df: pd.DataFrame) -> dict:
         ``experiments/prepare_data.py`` script.
     """
     dict_mentions = dict()
-    for i, row in df.iterrows():
-        article_id = str(row["article_id"])
-        dict_sentences = dict()
-        for s in eval_with_exception(row["sentences"]):
-            dict_sentences[int(s["sentence_pos"])] = s["sentence_text"]
+
+    # Process chunks of rows in the worker processes, and merge their results
+    # in the order of the rows:
+    if workers and len(df) > 1:
+        chunksize = max(1, -(-len(df) // (4 * workers)))
+        chunks = [df.iloc[i : i + chunksize] for i in range(0, len(df), chunksize)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for chunk_mentions in executor.map(prepare_initial_data, chunks):
+                for sentence_id, sentence_mentions in chunk_mentions.items():
+                    dict_mentions.setdefault(sentence_id, []).extend(sentence_mentions)
+        return dict_mentions
+
+    columns = ["article_id", "sentences", "annotations", "place", "place_wqid"]
+    for row in df[columns].itertuples(index=False):
+        article_id = str(row.article_id)
+        # Sentences of the article by position:
+        dict_sentences = {
+            int(s["sentence_pos"]): s["sentence_text"]
+            for s in eval_with_exception(row.sentences)
+        }
 
         # Build a mention dictionary per mention:
-        for df_mention in eval_with_exception(row["annotations"]):
+        for df_mention in eval_with_exception(row.annotations):
             dict_mention = dict()
             mention = df_mention["mention"]
             sent_idx = int(df_mention["sent_pos"])
             sentence_id = article_id + "_" + str(sent_idx)
 
-            # Generate left-hand context:
-            left_context = ""
-            if sent_idx - 1 in dict_sentences:
-                left_context = dict_sentences[sent_idx - 1]
-
-            # Generate right-hand context:
-            right_context = ""
-            if sent_idx + 1 in dict_sentences:
-                right_context = dict_sentences[sent_idx + 1]
+            # Generate left-hand and right-hand contexts:
+            left_context = dict_sentences.get(sent_idx - 1, "")
+            right_context = dict_sentences.get(sent_idx + 1, "")
 
             dict_mention["mention"] = df_mention["mention"]
             dict_mention["sent_idx"] = sent_idx
@@ -159,8 +438,8 @@ def prepare_initial_data(df: pd.DataFrame) -> dict:
             dict_mention["context"] = [left_context, right_context]
             dict_mention["pos"] = df_mention["mention_start"]
             dict_mention["end_pos"] = df_mention["mention_end"]
-            dict_mention["place"] = row["place"]
-            dict_mention["place_wqid"] = row["place_wqid"]
+            dict_mention["place"] = row.place
+            dict_mention["place_wqid"] = row.place_wqid
             dict_mention["candidates"] = []
             dict_mention["ner_label"] = df_mention["entity_type"]
 
@@ -169,10 +448,7 @@ def prepare_initial_data(df: pd.DataFrame) -> dict:
             if not df_mention["wkdt_qid"].startswith("Q"):
                 dict_mention["gold"] = "NIL"
 
-            if sentence_id in dict_mentions:
-                dict_mentions[sentence_id].append(dict_mention)
-            else:
-                dict_mentions[sentence_id] = [dict_mention]
+            dict_mentions.setdefault(sentence_id, []).append(dict_mention)
 
     return dict_mentions
 
@@ -189,16 +465,29 @@ def rank_candidates(rel_json: dict, wk_cands: dict, mentions_to_wikidata: dict)
             entities.
 
     Returns:
-        dict: A new JSON dictionary with ranked candidates for each mention.
+        dict: The same JSON dictionary, with ranked candidates for each
+        mention.
+
+    Note:
+        The JSON data is updated in place: the ``"candidates"`` of each mention
+        dictionary are replaced by the ranked candidates.
     """
-    new_json = dict()
+    # Ranked candidates of each mention, which are the same for all the
+    # occurrences of a mention, so they are only ranked once:
+    ranked_cands = dict()
     for article in rel_json:
-        new_json[article] = []
         for mention_dict in rel_json[article]:
+            mention = mention_dict["mention"]
+            cands = ranked_cands.get(mention)
+            if cands is not None:
+                # Each occurrence gets its own copy of the candidate lists:
+                mention_dict["candidates"] = [list(cand) for cand in cands]
+                continue
+
             cands = []
             tmp_cands = []
             max_cand_freq = 0
-            ranker_cands = wk_cands.get(mention_dict["mention"], dict())
+            ranker_cands = wk_cands.get(mention, dict())
             for c in ranker_cands:
                 # DeezyMatch confidence score (cosine similarity):
                 cand_selection_score = ranker_cands[c]["Score"]
@@ -225,10 +514,10 @@ def rank_candidates(rel_json: dict, wk_cands: dict, mentions_to_wikidata: dict)
                 cands.append([qc_id, round(qc_score, 3)])
             # Sort candidates and normalize between 0 and 1, and so they add up to 1.
             cands = sorted(cands, key=lambda x: (x[1], x[0]), reverse=True)
+            ranked_cands[mention] = cands
 
-            mention_dict["candidates"] = cands
-            new_json[article].append(mention_dict)
-    return new_json
+            mention_dict["candidates"] = [list(cand) for cand in cands]
+    return rel_json
 
 
 def add_publication(
@@ -246,15 +535,19 @@ def add_publication(
             to an empty string.
 
     Returns:
-        dict: A new JSON dictionary with the added publication information.
+        dict: The same JSON dictionary, with the added publication information.
+
+    Note:
+        The JSON data is updated in place: the publication entry is appended
+        to the list of mentions of each article.
     """
-    new_json = rel_json.copy()
-    for article in rel_json:
+    for article, article_mentions in rel_json.items():
         place = publname
         place_wqid = publwqid
         if article != "linking":
-            place = rel_json[article][0].get("place", publname)
-            place_wqid = rel_json[article][0].get("place_wqid", publwqid)
+            first_mention = article_mentions[0]
+            place = first_mention.get("place", publname)
+            place_wqid = first_mention.get("place_wqid", publwqid)
         preffix_sentence = "This article is published in "
         sentence = preffix_sentence + place + "."
         dict_publ = {
@@ -271,8 +564,8 @@ def add_publication(
             "place_wqid": place_wqid,
             "ner_label": "LOC",
         }
-        new_json[article].append(dict_publ)
-    return new_json
+        article_mentions.append(dict_publ)
+    return rel_json
 
 
 def prepare_rel_trainset(
@@ -295,7 +588,9 @@ def prepare_rel_trainset(
         df (pandas.DataFrame): The pandas DataFrame containing the prepared
             dataset.
         rel_params (dict): Dictionary containing the parameters for performing
-            entity disambiguation using the ``reldisamb`` approach.
+            entity disambiguation using the ``reldisamb`` approach. If it has
+            a ``"prepare_workers"`` key, its value is the number of worker
+            processes used by :py:func:`prepare_initial_data`.
         mentions_to_wikidata (dict): Dictionary mapping mentions to Wikidata
             entities, with counts.
         myranker (geoparser.ranking.Ranker): The Ranking object.
@@ -308,20 +603,19 @@ def prepare_rel_trainset(
     Note:
         This function stores the formatted dataset as a JSON file.
     """
-    rel_json = prepare_initial_data(df)
-
-    # Get unique mentions, to run them through the ranker:
-    all_mentions = []
-    for article in rel_json:
-        if rel_params["without_microtoponyms"]:
-            all_mentions += [
-                y["mention"] for y in rel_json[article] if y["ner_label"] == "LOC"
-            ]
-        else:
-            all_mentions += [y["mention"] for y in rel_json[article]]
-    all_mentions = list(set(all_mentions))
-    # Format the mentions are required by the ranker:
-    all_mentions = [{"mention": mention} for mention in all_mentions]
+    rel_json = prepare_initial_data(df, rel_params.get("prepare_workers", 0))
+
+    # Get unique mentions (in order of first appearance), to run them through
+    # the ranker, in a single pass over the mentions of all articles:
+    without_microtoponyms = rel_params["without_microtoponyms"]
+    unique_mentions = dict.fromkeys(
+        y["mention"]
+        for article_mentions in rel_json.values()
+        for y in article_mentions
+        if not without_microtoponyms or y["ner_label"] == "LOC"
+    )
+    # Format the unique mentions as required by the ranker:
+    all_mentions = [{"mention": mention} for mention in unique_mentions]
     # Use the ranker to find candidates:
     wk_cands, myranker.already_collected_cands = myranker.find_candidates(all_mentions)
     # Rank the candidates:
@@ -342,8 +636,8 @@ def prepare_rel_trainset(
     ## TO DO
     with open(
         os.path.join(rel_params["data_path"], "rel_{}.json").format(dsplit),
-        "w",
+        "wb",
     ) as f:
-        json.dump(rel_json, f)
+        f.write(orjson.dumps(rel_json, option=orjson.OPT_SERIALIZE_NUMPY))
 
     return rel_json